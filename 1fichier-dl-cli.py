@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+'''
+Headless 1fichier downloader.
+
+    python 1fichier-dl-cli.py LINK [LINK ...]
+    python 1fichier-dl-cli.py --daemon < links.txt
+
+In daemon mode links (optionally followed by a password) are read from
+stdin, one per line, while earlier ones download. The process exits once
+stdin is closed and every queued download has finished.
+'''
+import os
+import sys
+import argparse
+import logging
+from core.download.concurrency import AdaptiveConcurrency
+from core.download.engine import DownloadEngine
+from core.download.metadata_cache import get_metadata_cache
+from core.download import metrics
+from core.download.profiling import PROFILERS, start_profiler, stop_profiler
+from core.download.tracing import tracer
+
+log_level = logging.DEBUG
+if getattr(sys, 'frozen', False):
+    log_dir = os.path.join(os.path.dirname(sys.executable), 'app')
+    log_level = logging.INFO
+else:
+    log_dir = os.path.join(os.path.dirname(__file__), 'app')
+
+
+def print_progress(job, snapshot):
+    name = snapshot.name or job.progress.name or job.link
+    progress = f'{snapshot.progress:.2f} %' if snapshot.progress is not None else '-'
+    print(f'{name} | {snapshot.status} | {snapshot.proxy or ""} | '
+          f'{snapshot.speed} | {progress} | {snapshot.eta or "-"}', flush=True)
+
+
+def enqueue(engine, line, password=None):
+    parts = line.split()
+    if not parts:
+        return
+    try:
+        engine.enqueue(parts[0], parts[1] if len(parts) > 1 else password)
+    except (ValueError, OSError) as e:
+        print(e, file=sys.stderr, flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='1Fichier Downloader (headless)')
+    parser.add_argument('links', nargs='*', help='1fichier, folder or ouo.io links')
+    parser.add_argument('-p', '--password', help='password of protected files')
+    parser.add_argument('-d', '--directory', default='',
+                        help='download directory (default ~/Downloads)')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='simultaneous downloads (default 1)')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='adjust simultaneous downloads between 1 and --jobs')
+    parser.add_argument('-t', '--timeout', type=int, default=30,
+                        help='proxy timeout in seconds (default 30)')
+    parser.add_argument('--proxy-list', default='',
+                        help='URL of a proxy list replacing the default ones')
+    parser.add_argument('--race', type=int, default=4,
+                        help='proxies tried at once to find the link (default 4)')
+    parser.add_argument('--segments', type=int, default=1,
+                        help='connections per file (default 1)')
+    parser.add_argument('--limit', default='',
+                        help='bandwidth limit for all downloads, e.g. 2M (default none)')
+    parser.add_argument('--schedule', default='',
+                        help='limits by time of day, e.g. "08:00-23:00=512K; 23:00-08:00=0"')
+    parser.add_argument('--resolve-attempts', type=int, default=300,
+                        help='attempts to get the download link per file (default 300, 0 = no limit)')
+    parser.add_argument('--transfer-attempts', type=int, default=10,
+                        help='broken transfers per file before giving up (default 10, 0 = no limit)')
+    parser.add_argument('--max-backoff', type=float, default=30,
+                        help='longest wait between two attempts in seconds (default 30)')
+    parser.add_argument('--breaker-threshold', type=int, default=5,
+                        help='1fichier errors in a row that pause all downloads (default 5, 0 = off)')
+    parser.add_argument('--metrics-port', type=int, default=0,
+                        help='serve Prometheus metrics on this port (default off)')
+    parser.add_argument('--metrics-host', default='127.0.0.1',
+                        help='address of the metrics endpoint (default 127.0.0.1)')
+    parser.add_argument('--metrics-json', default='',
+                        help='write the metrics as JSON to this file every minute')
+    parser.add_argument('--trace', default='',
+                        help='write the download phases as Chrome trace JSON to this file')
+    parser.add_argument('--profile', choices=PROFILERS,
+                        help='profile the run with cProfile or a sampling profiler')
+    parser.add_argument('--profile-out', default='',
+                        help='profile output (default app/profile.pstats or app/profile.folded)')
+    parser.add_argument('--daemon', action='store_true',
+                        help='read links from stdin and keep running')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='do not print progress')
+    args = parser.parse_args()
+
+    os.makedirs(log_dir, exist_ok=True)
+    logging.basicConfig(filename=os.path.join(log_dir, 'logs.txt'),
+                        level=log_level, filemode='a')
+
+    if args.trace:
+        tracer.enable()
+    start_profiler(args.profile)
+
+    # Same layout as the GUI's app/settings
+    settings = [args.directory, 0, args.timeout, args.proxy_list, args.jobs,
+                args.race, args.segments, args.limit, args.schedule,
+                False, None, 0, '', '', '',
+                args.resolve_attempts, args.transfer_attempts, args.max_backoff,
+                args.breaker_threshold]
+    engine = DownloadEngine(settings, args.jobs,
+                            None if args.quiet else print_progress)
+    if args.metrics_port:
+        metrics.serve_metrics(args.metrics_port, args.metrics_host)
+    dumper = metrics.MetricsDumper(args.metrics_json) if args.metrics_json else None
+    if args.adaptive:
+        AdaptiveConcurrency(engine, 1, args.jobs, on_decision=None if args.quiet else (
+            lambda workers, reason: print(f'{workers} parallel downloads: {reason}',
+                                          flush=True))).start()
+
+    for link in args.links:
+        enqueue(engine, link, args.password)
+
+    if args.daemon:
+        for line in sys.stdin:
+            enqueue(engine, line, args.password)
+    engine.wait()
+    engine.close()
+    get_metadata_cache().save()
+    if dumper:
+        dumper.stop()
+    if args.trace:
+        tracer.export(args.trace)
+    stop_profiler(args.profile_out)
+    failed = [job for job in engine.jobs if not job.complete]
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    try:
+        sys.exit(main())
+    except KeyboardInterrupt:
+        sys.exit(130)
@@ -0,0 +1,224 @@
+'''
+End-to-end download scenarios against the local stand-in.
+
+    python benchmarks/bench_download.py
+    python benchmarks/bench_download.py --scenario large --large-size 1073741824
+    python benchmarks/bench_download.py --save baseline.json
+    python benchmarks/bench_download.py --baseline baseline.json
+
+Scenarios:
+    large     one big file over a single connection (the download() hot loop)
+    small     many small files, several at a time
+    resume    one big file, half of it already on disk (only the rest may be fetched)
+    password  password protected files
+    folder    every file of a /dir/ listing
+
+Each scenario runs in its own process and reports throughput, mean time to
+first byte, client CPU seconds per GB and peak memory. With --baseline the
+run fails when throughput drops or CPU per GB grows by more than --tolerance.
+'''
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_engines import peak_rss_mb
+
+SCENARIOS = ('large', 'small', 'resume', 'password', 'folder')
+PASSWORD = 'bench'
+GB = 1024 ** 3
+
+
+def start_server(size, bandwidth, latency, password=None, folder_files=0):
+    '''
+    Run the stand-in in its own process so it does not count in the figures.
+    Returns (process, url).
+    '''
+    command = [sys.executable, os.path.join(os.path.dirname(__file__), 'fake_server.py'),
+               '--size', str(size), '--bandwidth', str(bandwidth),
+               '--latency', str(latency), '--folder-files', str(folder_files)]
+    if password:
+        command += ['--password', password]
+    server = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    return server, server.stdout.readline().strip()
+
+
+def verify(path, size):
+    '''
+    True if `path` holds exactly the bytes the stand-in serves.
+    '''
+    from fake_server import file_bytes
+    if os.path.getsize(path) != size:
+        return False
+    block = 1024 * 1024
+    with open(path, 'rb') as f:
+        for start in range(0, size, block):
+            if f.read(block) != file_bytes(start, min(start + block, size)):
+                return False
+    return True
+
+
+def histogram_mean(histogram):
+    count = total = 0
+    for values in histogram.as_dict():
+        count += values['count']
+        total += values['sum']
+    return total / count if count else 0.0
+
+
+def run_scenario(name, args):
+    from core.download import metrics
+    from core.download.engine import DownloadEngine, DownloadJob, proxy_pool
+    from core.download.folders import iter_folder
+
+    size = args.small_size if name in ('small', 'password', 'folder') else args.large_size
+    count = {'small': args.small_count, 'password': args.password_count,
+             'folder': args.small_count}.get(name, 1)
+    password = PASSWORD if name == 'password' else None
+    server, url = start_server(size, args.bandwidth, args.latency, password,
+                               count if name == 'folder' else 0)
+    work_dir = tempfile.mkdtemp(prefix='1fichier-bench-')
+    try:
+        os.chdir(work_dir)
+        # Direct connections: the stand-in is plain http, 'https' proxies are not used.
+        # No refills from the real proxy lists.
+        proxy_pool.low_water = 0
+        for _ in range(count * 4):
+            proxy_pool.put({'https': None})
+        settings = [work_dir, 0, 30, '', args.jobs, 1, args.segments]
+
+        dl_name = ''
+        if name == 'resume':
+            from fake_server import file_bytes
+            dl_name = 'f0.bin.unfinished'
+            with open(os.path.join(work_dir, dl_name), 'wb') as f:
+                block = 1024 * 1024
+                for start in range(0, size // 2, block):
+                    f.write(file_bytes(start, min(start + block, size // 2)))
+
+        cpu = time.process_time()
+        start = time.time()
+        engine = DownloadEngine(settings, max_workers=args.jobs)
+        if name == 'folder':
+            links = [entry[0] for batch in iter_folder(f'{url}/dir/bench') for entry in batch]
+        else:
+            links = [f'{url}/?f{n}' for n in range(count)]
+        for link in links:
+            job = DownloadJob(link, settings, dl_name, password or 'No password')
+            engine.submit(job)
+        engine.wait()
+        elapsed = time.time() - start
+        cpu = time.process_time() - cpu
+        server.terminate()
+
+        done = [job for job in engine.jobs if job.complete]
+        received = sum(v['value'] for v in metrics.BYTES.as_dict())
+        files = [os.path.join(work_dir, f) for f in os.listdir(work_dir)
+                 if f.endswith('.bin')]
+        verified = all(verify(path, size) for path in files) and len(files) == len(links)
+        if name == 'resume':
+            from core.download.resume import TAIL_BLOCK
+            # The half on disk must not be downloaded again
+            verified = verified and received <= size - size // 2 + TAIL_BLOCK
+        return {
+            'scenario': name,
+            'files': f'{len(done)}/{len(links)}',
+            'verified': verified,
+            'seconds': round(elapsed, 2),
+            'throughput_mb_s': round(received / elapsed / 1024 / 1024, 2),
+            'ttfb_ms': round(histogram_mean(metrics.TTFB_SECONDS) * 1000, 1),
+            'cpu_s_per_gb': round(cpu / max(received, 1) * GB, 2),
+            'peak_rss_mb': round(peak_rss_mb(), 1),
+        }
+    finally:
+        # Downloaded files can take gigabytes
+        os.chdir(ROOT)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+
+def compare(results, baseline, tolerance):
+    '''
+    Lines describing the regressions of `results` against `baseline`.
+    '''
+    previous = {result['scenario']: result for result in baseline}
+    regressions = []
+    for result in results:
+        old = previous.get(result['scenario'])
+        if not old:
+            continue
+        if result['throughput_mb_s'] < old['throughput_mb_s'] * (1 - tolerance):
+            regressions.append(f'{result["scenario"]}: throughput {old["throughput_mb_s"]}'
+                               f' -> {result["throughput_mb_s"]} MB/s')
+        if result['cpu_s_per_gb'] > old['cpu_s_per_gb'] * (1 + tolerance):
+            regressions.append(f'{result["scenario"]}: CPU {old["cpu_s_per_gb"]}'
+                               f' -> {result["cpu_s_per_gb"]} s/GB')
+        if not result['verified']:
+            regressions.append(f'{result["scenario"]}: downloaded files differ')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenario', choices=SCENARIOS, action='append',
+                        help='run only these scenarios (repeatable)')
+    parser.add_argument('--large-size', type=int, default=256 * 1024 * 1024)
+    parser.add_argument('--small-size', type=int, default=256 * 1024)
+    parser.add_argument('--small-count', type=int, default=100)
+    parser.add_argument('--password-count', type=int, default=10)
+    parser.add_argument('--jobs', type=int, default=8,
+                        help='simultaneous downloads (default 8)')
+    parser.add_argument('--segments', type=int, default=1,
+                        help='connections per file (default 1)')
+    parser.add_argument('--bandwidth', type=int, default=0,
+                        help='bytes/s per connection (0 = unlimited)')
+    parser.add_argument('--latency', type=float, default=0.01)
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='JSON file of an earlier --save')
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help='allowed relative change against the baseline')
+    parser.add_argument('--run', choices=SCENARIOS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(run_scenario(args.run, args)))
+        return 0
+
+    options = []
+    for option in ('large_size', 'small_size', 'small_count', 'password_count',
+                   'jobs', 'segments', 'bandwidth', 'latency'):
+        options += [f'--{option.replace("_", "-")}', str(getattr(args, option))]
+    results = []
+    for name in args.scenario or SCENARIOS:
+        out = subprocess.run([sys.executable, __file__, '--run', name] + options,
+                             capture_output=True, text=True, check=True)
+        results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    columns = list(results[0])
+    print(' | '.join(f'{c:>15}' for c in columns))
+    for result in results:
+        print(' | '.join(f'{str(result[c]):>15}' for c in columns))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f'REGRESSION {line}')
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,134 @@
+'''
+Thread-per-download engine vs asyncio engine against the local stand-in.
+
+    python benchmarks/bench_engines.py --jobs 200 --size 1048576 --bandwidth 262144
+
+Each engine runs in its own process so peak memory is measured separately.
+'''
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def peak_rss_mb():
+    try:
+        import resource
+        # kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    except ImportError:
+        return float('nan')
+
+
+def start_server(size, bandwidth, latency):
+    '''
+    Run the stand-in in its own process so it does not count in the figures.
+    Returns (process, url).
+    '''
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(__file__), 'fake_server.py'),
+         '--size', str(size), '--bandwidth', str(bandwidth), '--latency', str(latency)],
+        stdout=subprocess.PIPE, text=True)
+    return server, server.stdout.readline().strip()
+
+
+def run_engine(mode, jobs, size, bandwidth, latency):
+    from core.download.engine import DownloadEngine, DownloadJob, proxy_pool
+
+    server, url = start_server(size, bandwidth, latency)
+    work_dir = tempfile.mkdtemp(prefix='1fichier-bench-')
+    try:
+        os.chdir(work_dir)
+        # Direct connections: the stand-in is plain http, 'https' proxies are not used.
+        # No refills from the real proxy lists.
+        proxy_pool.low_water = 0
+        for _ in range(jobs * 4):
+            proxy_pool.put({'https': None})
+        settings = [work_dir, 0, 30, '', jobs, 1, 1]
+
+        peak_threads = threading.active_count()
+        sampling = True
+
+        def sample():
+            nonlocal peak_threads
+            while sampling:
+                peak_threads = max(peak_threads, threading.active_count())
+                time.sleep(0.05)
+
+        threading.Thread(target=sample, daemon=True).start()
+        start = time.time()
+        if mode == 'thread':
+            engine = DownloadEngine(settings, max_workers=jobs)
+            for n in range(jobs):
+                engine.submit(DownloadJob(f'{url}/?f{n}', settings))
+            engine.wait()
+            done = [job for job in engine.jobs if job.complete]
+        else:
+            import asyncio
+            from core.download.async_engine import AsyncDownloadEngine
+            engine = AsyncDownloadEngine(settings, max_jobs=jobs)
+            for n in range(jobs):
+                engine.submit(DownloadJob(f'{url}/?f{n}', settings))
+            asyncio.run(engine.run())
+            done = [job for job in engine.jobs if job.complete]
+        elapsed = time.time() - start
+        sampling = False
+
+        server.terminate()
+        return {
+            'mode': mode,
+            'jobs': jobs,
+            'completed': len(done),
+            'seconds': round(elapsed, 2),
+            'throughput_mb_s': round(len(done) * size / elapsed / 1024 / 1024, 2),
+            'peak_threads': peak_threads,
+            'peak_rss_mb': round(peak_rss_mb(), 1),
+            'cpu_seconds': round(time.process_time(), 2),
+        }
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--jobs', type=int, default=100)
+    parser.add_argument('--size', type=int, default=1024 * 1024)
+    parser.add_argument('--bandwidth', type=int, default=256 * 1024,
+                        help='bytes/s per connection (0 = unlimited)')
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--mode', choices=['thread', 'async'],
+                        help='run a single engine in this process')
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run_engine(args.mode, args.jobs, args.size,
+                                    args.bandwidth, args.latency)))
+        return
+
+    results = []
+    for mode in ('thread', 'async'):
+        out = subprocess.run(
+            [sys.executable, __file__, '--mode', mode, '--jobs', str(args.jobs),
+             '--size', str(args.size), '--bandwidth', str(args.bandwidth),
+             '--latency', str(args.latency)],
+            capture_output=True, text=True, check=True)
+        results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    columns = list(results[0])
+    print(' | '.join(f'{c:>15}' for c in columns))
+    for result in results:
+        print(' | '.join(f'{str(result[c]):>15}' for c in columns))
+
+
+if __name__ == '__main__':
+    main()
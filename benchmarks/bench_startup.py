@@ -0,0 +1,134 @@
+'''
+Cold start of the GUI: import time and time to the first paint.
+
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --import-budget 150 --paint-budget 1500
+    python benchmarks/bench_startup.py --exe dist/1fichier-dl.exe
+
+Import time is read from `python -X importtime -c "import core.gui.gui"`,
+the first paint is the time from starting the process until the main window
+is painted (`--startup-time`, works for the PyInstaller build too). Both
+are medians over --runs fresh processes. Modules that must stay out of the
+startup path (requests, lxml...) are checked as well. Exits with 1 when a
+budget is exceeded, a deferred module is imported at startup or the app
+dies before painting (its output is printed).
+'''
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Loaded on first use, never before the window is shown
+DEFERRED = ('requests', 'urllib3', 'lxml', 'bs4', 'curl_cffi', 'tkinter',
+            'qdarktheme', 'asyncio', 'http.server')
+
+
+def import_time_ms(module='core.gui.gui'):
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                         cwd=ROOT, capture_output=True, text=True, check=True)
+    # Children are listed before their parent, one more space of indent per level
+    children = []
+    for line in out.stderr.splitlines():
+        parts = line.split('|')
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        us, name = int(parts[1]), parts[2].rstrip()
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 0 and name.strip() == module:
+            top = sorted(children, reverse=True)[:5]
+            return us / 1000, [(child, child_us / 1000) for child_us, child in top]
+        if depth == 0:
+            # Imported at interpreter startup (site, .pth files)
+            children = []
+        elif depth == 1:
+            children.append((us, name.strip()))
+    raise RuntimeError(f'{module} not found in the -X importtime output')
+
+
+def deferred_imports(module='core.gui.gui'):
+    out = subprocess.run(
+        [sys.executable, '-c', f'import sys, {module}; '
+                               f'print(" ".join(m for m in {DEFERRED!r} if m in sys.modules))'],
+        cwd=ROOT, capture_output=True, text=True, check=True)
+    return out.stdout.split()
+
+
+def first_paint_ms(command):
+    '''
+    Milliseconds from starting `command` until it wrote its first paint time.
+    Raises RuntimeError with the app's output if it never painted.
+    '''
+    with tempfile.TemporaryDirectory(prefix='1fichier-startup-') as work_dir:
+        path = os.path.join(work_dir, 'paint')
+        env = dict(os.environ)
+        if sys.platform.startswith('linux') and not env.get('DISPLAY'):
+            # Headless CI
+            env.setdefault('QT_QPA_PLATFORM', 'offscreen')
+        start = time.time()
+        with open(os.path.join(work_dir, 'output'), 'w+') as output:
+            process = subprocess.Popen(command + ['--startup-time', path], cwd=work_dir,
+                                       env=env, stdout=output, stderr=subprocess.STDOUT)
+            try:
+                code = process.wait(timeout=120)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                code = 'a timeout'
+            try:
+                with open(path) as f:
+                    return (float(f.read()) - start) * 1000
+            except (OSError, ValueError):
+                output.seek(0)
+                raise RuntimeError(f'{" ".join(command)} exited with {code} '
+                                   f'before painting:\n{output.read()[-4000:]}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--exe', help='PyInstaller build to measure as well')
+    parser.add_argument('--import-budget', type=float, default=0,
+                        help='maximum import time of core.gui.gui in ms (0 = none)')
+    parser.add_argument('--paint-budget', type=float, default=0,
+                        help='maximum time to the first paint in ms (0 = none)')
+    args = parser.parse_args()
+
+    failures = []
+    imports = [import_time_ms() for _ in range(args.runs)]
+    import_ms = statistics.median(ms for ms, top in imports)
+    print(f'import core.gui.gui: {import_ms:.1f} ms')
+    for name, ms in imports[-1][1]:
+        print(f'    {name:<35} {ms:8.1f} ms')
+    if args.import_budget and import_ms > args.import_budget:
+        failures.append(f'import time {import_ms:.1f} ms > {args.import_budget:g} ms')
+
+    loaded = deferred_imports()
+    if loaded:
+        failures.append(f'imported at startup: {", ".join(loaded)}')
+
+    builds = [('source', [sys.executable, os.path.join(ROOT, '1fichier-dl.py')])]
+    if args.exe:
+        builds.append(('pyinstaller', [os.path.abspath(args.exe)]))
+    for name, command in builds:
+        try:
+            paint_ms = statistics.median(first_paint_ms(command) for _ in range(args.runs))
+        except RuntimeError as e:
+            print(e, file=sys.stderr)
+            failures.append(f'{name} did not paint its window')
+            continue
+        print(f'first paint ({name}): {paint_ms:.1f} ms')
+        if args.paint_budget and paint_ms > args.paint_budget:
+            failures.append(f'first paint ({name}) {paint_ms:.1f} ms > {args.paint_budget:g} ms')
+
+    for failure in failures:
+        print(f'OVER BUDGET {failure}')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
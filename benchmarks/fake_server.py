@@ -0,0 +1,165 @@
+'''
+Local stand-in for 1fichier used by the benchmarks.
+
+    GET  /?<id>            landing page (name and size in td.normal cells)
+    POST /?<id>            page holding the direct link at /html/body/div[4]/div[2]/a,
+                           or the password form (//*[@id="pass"]) when
+                           `password` is set and the form did not send it
+    GET  /dl/<id>          the file, with Content-Disposition and Range support
+    GET  /dir/<id>?json=1  listing of a folder of `folder_files` files
+
+Every file is `size` bytes of a repeated pattern, `bandwidth` (bytes/s)
+limits each connection and `latency` (seconds) delays every response.
+'''
+import re
+import json
+import time
+import threading
+from urllib.parse import parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+PATTERN = bytes(range(256)) * 256
+
+LANDING_PAGE = '''<html><body><table>
+<tr><td class="normal">{name}</td><td class="normal"></td><td class="normal">{size}</td></tr>
+</table></body></html>'''
+
+LINK_PAGE = '''<html><body><div></div><div></div><div></div>
+<div><div></div><div><a href="{link}">Click here to download the file</a></div></div>
+</body></html>'''
+
+PASSWORD_PAGE = '''<html><body>{message}
+<form method="post"><input type="password" name="pass" id="pass"></form>
+</body></html>'''
+
+
+def file_bytes(start, end):
+    '''
+    Bytes [start, end) of any served file.
+    '''
+    out = bytearray()
+    while start < end:
+        offset = start % len(PATTERN)
+        piece = PATTERN[offset:offset + end - start]
+        out += piece
+        start += len(piece)
+    return bytes(out)
+
+
+class FakeFichierHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def file_id(self):
+        return self.path.split('?')[-1].split('/')[-1] or 'file'
+
+    def host(self):
+        return f'http://127.0.0.1:{self.server.server_port}'
+
+    def send_page(self, body, content_type='text/html'):
+        body = body.encode()
+        time.sleep(self.server.latency)
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        form = parse_qs(self.rfile.read(
+            int(self.headers.get('Content-Length', 0))).decode())
+        if self.server.password:
+            sent = form.get('pass', [None])[0]
+            if sent is None:
+                self.send_page(PASSWORD_PAGE.format(message=''))
+                return
+            if sent != self.server.password:
+                self.send_page(PASSWORD_PAGE.format(message='Bad password'))
+                return
+        self.send_page(LINK_PAGE.format(link=f'{self.host()}/dl/{self.file_id()}'))
+
+    def send_folder(self):
+        folder = self.path.split('?')[0].rstrip('/').split('/')[-1]
+        private = 1 if self.server.password else 0
+        files = [{'link': f'{self.host()}/?{folder}f{n}', 'filename': f'{folder}f{n}.bin',
+                  'size': self.server.size, 'password': private}
+                 for n in range(self.server.folder_files)]
+        self.send_page(json.dumps(files), 'application/json')
+
+    def do_GET(self):
+        if self.path.startswith('/dir/'):
+            self.send_folder()
+            return
+        if not self.path.startswith('/dl/'):
+            self.send_page(LANDING_PAGE.format(
+                name=f'{self.file_id()}.bin', size=f'{self.server.size} B'))
+            return
+
+        size = self.server.size
+        start, end = 0, size
+        status = 200
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if match:
+            start = int(match[1])
+            end = int(match[2]) + 1 if match[2] else size
+            status = 206
+        time.sleep(self.server.latency)
+        self.send_response(status)
+        self.send_header('Content-Disposition',
+                         f'attachment; filename="{self.file_id()}.bin"')
+        self.send_header('Content-Length', str(end - start))
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {start}-{end - 1}/{size}')
+        self.end_headers()
+
+        chunk = 64 * 1024
+        try:
+            while start < end:
+                piece = file_bytes(start, min(start + chunk, end))
+                self.wfile.write(piece)
+                start += len(piece)
+                if self.server.bandwidth:
+                    time.sleep(len(piece) / self.server.bandwidth)
+        except OSError:
+            pass
+
+
+class FakeFichierServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, size=1024 * 1024, bandwidth=0, latency=0.0, port=0,
+                 password=None, folder_files=100):
+        self.size = size
+        self.bandwidth = bandwidth
+        self.latency = latency
+        self.password = password
+        self.folder_files = folder_files
+        super().__init__(('127.0.0.1', port), FakeFichierHandler)
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_port}'
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Local 1fichier stand-in')
+    parser.add_argument('--size', type=int, default=1024 * 1024)
+    parser.add_argument('--bandwidth', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--password', default=None)
+    parser.add_argument('--folder-files', type=int, default=100)
+    args = parser.parse_args()
+    server = FakeFichierServer(args.size, args.bandwidth, args.latency, args.port,
+                               args.password, args.folder_files)
+    # First line tells the parent process where to connect
+    print(server.url, flush=True)
+    server.serve_forever()
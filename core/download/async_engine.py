@@ -0,0 +1,401 @@
+import os
+import time
+import queue
+import asyncio
+import logging
+import lxml.html
+from curl_cffi.requests import AsyncSession, RequestsError
+from . import retry
+from .bandwidth import apply_settings, bandwidth
+from .download import DIRECT_LINK_XPATH, discard_partial, no_link_outcome, resolution_outcome
+from .engine import DownloadJob, NO_PASSWORD, normalize_link
+from .metrics import JOBS, RESOLUTIONS, RESOLVE_SECONDS, TTFB_SECONDS
+from .progress import ProgressBus
+from .proxy_pool import FAILURE, SUCCESS
+from .proxy_store import get_proxy_store, proxy_key
+from .resume import (TAIL_BLOCK, ResumeError, ResumeIndex, TailCheck,
+                     check_content_range, resume_point)
+from .retry import RESOLVE, TRANSFER, breaker, transfer_failed, wait_retry_async
+from .segments import SAVE_INTERVAL
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/116.0.0.0 Safari/537.36 Edg/116.0.1938.54',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.5',
+    'Upgrade-Insecure-Requests': '1',
+}
+PAYLOAD = {'dl_no_ssl': 'on', 'dlinline': 'on'}
+# Bytes collected before they are written to disk from a worker thread
+WRITE_BLOCK = 1024 * 1024
+
+
+def as_curl_proxies(proxy):
+    '''
+    {'https': 'socks5://ip:port', ...} -> proxies argument of curl_cffi.
+    '''
+    url = proxy.get('https') if isinstance(proxy, dict) else proxy
+    return {'https': url} if url else None
+
+
+def open_at(path, offset):
+    '''
+    Open the partial file `path` for writing from byte `offset`.
+    '''
+    f = open(path, 'r+b' if offset and os.path.exists(path) else 'wb')
+    f.truncate(offset)
+    f.seek(offset)
+    return f
+
+
+class AsyncDownloadEngine:
+    '''
+    Downloads many DownloadJobs on one asyncio event loop.
+    Link resolution, proxy races and transfers of every job share a single
+    curl_cffi AsyncSession, so hundreds of jobs need no extra threads.
+    Segmented downloads are not supported here, files use one connection.
+    Parsing, disk and SQLite work runs in worker threads (asyncio.to_thread)
+    so it never stalls the other jobs.
+    '''
+
+    def __init__(self, settings=None, max_jobs=100, on_progress=None, interval=0.5):
+        self.settings = settings
+        self.max_jobs = max_jobs
+        self.on_progress = on_progress
+        self.interval = interval
+        if settings:
+            apply_settings(settings)
+            retry.apply_settings(settings)
+        self.bus = ProgressBus()
+        self.jobs = []
+
+    def enqueue(self, link, password=None, dl_name=''):
+        '''
+        Queue a download. The password is asked for (status
+        'Waiting for password') only if the file turns out to be protected.
+        '''
+        job = DownloadJob(normalize_link(link), self.settings, dl_name,
+                          password if password else NO_PASSWORD)
+        return self.submit(job)
+
+    def submit(self, job):
+        if job.progress is None:
+            job.progress = self.bus.track(job)
+        job.progress.update(status='Waiting')
+        self.jobs.append(job)
+        return job
+
+    async def run(self):
+        '''
+        Download every queued job, `max_jobs` at a time.
+        '''
+        semaphore = asyncio.Semaphore(self.max_jobs)
+        publisher = asyncio.create_task(self._publish()) if self.on_progress else None
+
+        async def limited(session, job):
+            async with semaphore:
+                try:
+                    await self.download(session, job)
+                except retry.RetryError as e:
+                    logging.info(f'Gave up on {job.link}: {e}')
+                    job.progress.stop_transfer(str(e))
+                    JOBS.inc(result='failed')
+                except Exception as e:
+                    logging.exception(e)
+                    job.progress.stop_transfer('Error')
+                    JOBS.inc(result='failed')
+                else:
+                    if job.complete:
+                        JOBS.inc(result='complete')
+                finally:
+                    # Proxies of an unfinished attempt go back to the pool
+                    job.proxies.release_all(job)
+
+        async with AsyncSession(max_clients=self.max_jobs * 4) as session:
+            await asyncio.gather(*[limited(session, job) for job in self.jobs])
+
+        if publisher:
+            publisher.cancel()
+            self._flush()
+
+    async def _publish(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self._flush()
+
+    def _flush(self):
+        for job, snapshot in self.bus.collect():
+            try:
+                self.on_progress(job, snapshot)
+            except Exception as e:
+                logging.error(f'Progress callback failed: {e}')
+
+    async def get_proxy(self, job):
+        '''
+        Lease the next proxy without blocking the event loop.
+        None once the job is stopped or paused.
+        '''
+        while not (job.stopped or job.paused):
+            try:
+                return job.proxies.lease(job, block=False)
+            except queue.Empty:
+                job.proxies.refill(job.proxy_settings)
+                await asyncio.sleep(0.5)
+        return None
+
+    async def post_form(self, session, job, payload, proxy):
+        start = time.time()
+        try:
+            r = await session.post(job.link, data=payload, headers=HEADERS,
+                                   proxies=as_curl_proxies(proxy),
+                                   timeout=job.timeout, verify=False)
+            html = await asyncio.to_thread(lxml.html.fromstring, r.content)
+        except Exception:
+            await asyncio.to_thread(get_proxy_store().record_failure, proxy)
+            RESOLUTIONS.inc(outcome='error')
+            raise
+        await asyncio.to_thread(get_proxy_store().record_success, proxy, time.time() - start)
+        RESOLVE_SECONDS.observe(time.time() - start)
+        if r.status_code >= 500:
+            # Answered through a working proxy, so 1fichier itself is failing
+            breaker.record_failure()
+        if html.xpath('//*[@id="pass"]'):
+            password = await self.wait_for_password(job, '')
+            if password is None:
+                return r, html
+            payload = dict(payload, **{'pass': password})
+            r = await session.post(job.link, data=payload,
+                                   proxies=as_curl_proxies(proxy),
+                                   timeout=job.timeout, verify=False)
+            html = await asyncio.to_thread(lxml.html.fromstring, r.content)
+        RESOLUTIONS.inc(outcome=resolution_outcome(r, html))
+        return r, html
+
+    async def wait_for_password(self, job, bad_password):
+        '''
+        Wait until the job has a password other than `bad_password`.
+        Returns None if the job was stopped or paused meanwhile.
+        '''
+        status = 'Bad password' if bad_password else 'Waiting for password'
+        while not (job.stopped or job.paused):
+            password = job.get_password()
+            if password not in (bad_password, NO_PASSWORD, None):
+                return password
+            job.progress.update(status=status)
+            await asyncio.sleep(2)
+        return None
+
+    async def attempt(self, session, job, proxy):
+        '''
+        (proxy, response, html), response is None if the proxy failed.
+        '''
+        try:
+            r, html = await self.post_form(session, job, PAYLOAD, proxy)
+        except Exception as e:
+            logging.debug('Proxy failed. \n'+f'{e}')
+            return proxy, None, None
+        return proxy, r, html
+
+    async def resolve(self, session, job, attempts):
+        '''
+        Race `job.race_count` proxies, the first page with a direct link wins
+        and the other requests are cancelled.
+        Returns (proxy, direct link or None, attempts), the winning proxy
+        stays leased.
+        '''
+        proxy = await self.get_proxy(job)
+        if proxy is None:
+            return None, None, attempts
+        # Races whatever the pool holds rather than waiting for race_count
+        proxies = [proxy]
+        while len(proxies) < job.race_count:
+            try:
+                proxy = job.proxies.lease(job, block=False)
+            except queue.Empty:
+                break
+            if proxy is None:
+                break
+            proxies.append(proxy)
+        tasks = {asyncio.ensure_future(self.attempt(session, job, p)): p
+                 for p in proxies}
+        try:
+            for future in asyncio.as_completed(list(tasks)):
+                proxy, r, html = await future
+                if r is None:
+                    job.proxies.release(proxy, FAILURE)
+                else:
+                    link = html.xpath(DIRECT_LINK_XPATH)
+                    if link:
+                        return proxy, link[0].get('href'), attempts
+                    if 'Bad password' in r.text:
+                        job.proxies.release(proxy, SUCCESS)
+                        await self.wait_for_password(job, job.get_password())
+                    else:
+                        job.proxies.release(proxy, *no_link_outcome(r.text))
+                attempts += 1
+                job.progress.update(status=f'Bypassing ({attempts})',
+                                    proxy='Change Proxy')
+                if job.stopped or job.paused:
+                    break
+        finally:
+            for task, p in tasks.items():
+                if not task.done():
+                    task.cancel()
+                    # Never answered, not proven dead
+                    job.proxies.release(p)
+        return None, None, attempts
+
+    async def download(self, session, job):
+        '''
+        Async counterpart of download.download() for one job.
+        '''
+        attempts = 0
+        job.progress.update(status='Loading', proxy='Viewing')
+        budget = retry.policy.budget()
+        # Backoff before the next attempt, set by budget.fail()
+        delay = 0.0
+        proxy = None
+        while not (job.stopped or job.paused):
+            if proxy:
+                # Not proven good or bad by the previous attempt
+                job.proxies.release(proxy)
+                proxy = None
+            if not await wait_retry_async(job, delay, budget):
+                break
+            delay = 0.0
+            tried = attempts
+            proxy, urlx, attempts = await self.resolve(session, job, attempts)
+            if not urlx:
+                if job.stopped or job.paused:
+                    break
+                delay = budget.fail(RESOLVE, max(attempts - tried, 1))
+                continue
+            budget.succeed(RESOLVE)
+            job.progress.update(status='우회 성공', proxy=proxy_key(proxy))
+
+            tail_block = TAIL_BLOCK if job.verify_tail else 0
+            downloaded_size, expected_total, tail = 0, None, None
+            if job.dl_name:
+                downloaded_size, expected_total, tail = await asyncio.to_thread(
+                    resume_point, job.dl_directory + '/' + job.dl_name, tail_block)
+            # Ask again for the block before the resume point to check it
+            overlap = min(tail_block, downloaded_size) if tail else 0
+            headers = dict(HEADERS, Referer=job.link,
+                           Range=f'bytes={downloaded_size - overlap}-')
+
+            requested = time.time()
+            connected = False
+            done = downloaded_size
+            try:
+                async with session.stream('GET', urlx, headers=headers,
+                                          proxies=as_curl_proxies(proxy),
+                                          timeout=job.timeout, verify=False) as rx:
+                    TTFB_SECONDS.observe(time.time() - requested)
+                    connected = True
+                    if rx.status_code >= 500:
+                        logging.debug(f'Direct link answered {rx.status_code}.')
+                        breaker.record_failure()
+                        delay = budget.fail(TRANSFER)
+                        continue
+                    if 'Content-Disposition' not in rx.headers:
+                        logging.debug(
+                            'No Content-Disposition header. Restarting download.')
+                        delay = budget.fail(TRANSFER)
+                        continue
+                    name = job.dl_name or await asyncio.to_thread(self.file_name, job, rx)
+                    job.dl_name = name
+                    path = job.dl_directory + '/' + name
+                    try:
+                        if rx.status_code == 206:
+                            total = check_content_range(
+                                rx, downloaded_size - overlap, expected_total)
+                        else:
+                            # Range ignored, the body is the whole file
+                            total = int(rx.headers['Content-Length'])
+                            downloaded_size = overlap = 0
+                        check = TailCheck(overlap, tail) if overlap else None
+                        job.progress.update(name=name[:-11])
+                        job.progress.start_transfer(total, downloaded_size)
+                        start = time.time()
+                        index = ResumeIndex(path, total, downloaded_size)
+                        done = downloaded_size
+                        saved = time.time()
+                        buffer = bytearray()
+                        f = await asyncio.to_thread(open_at, path, downloaded_size)
+                        try:
+                            async for chunk in rx.aiter_content():
+                                if check:
+                                    chunk = check.feed(chunk)
+                                await bandwidth.acquire_async(len(chunk), job.priority, job)
+                                buffer += chunk
+                                done += len(chunk)
+                                job.progress.add(len(chunk))
+                                if job.stopped or job.paused:
+                                    await self.write_out(f, buffer, index, done, tail_block)
+                                    job.progress.stop_transfer()
+                                    return name
+                                if time.time() - saved > SAVE_INTERVAL:
+                                    await self.write_out(f, buffer, index, done, tail_block)
+                                    saved = time.time()
+                                elif len(buffer) >= WRITE_BLOCK:
+                                    await self.write_out(f, buffer)
+                            if done < total:
+                                await self.write_out(f, buffer, index, done, tail_block)
+                            else:
+                                await self.write_out(f, buffer)
+                        finally:
+                            await asyncio.to_thread(f.close)
+                    except ResumeError as e:
+                        # Resuming would corrupt the file, only a full download is safe
+                        logging.debug(f'{e}. Restarting download from the start.')
+                        job.progress.stop_transfer()
+                        await asyncio.to_thread(discard_partial, path)
+                        delay = budget.fail(TRANSFER)
+                        continue
+            except (RequestsError, OSError) as e:
+                if not connected:
+                    # The proxy just worked, the site is the one failing
+                    breaker.record_failure()
+                logging.debug(f'Transfer failed: {e}')
+                job.progress.stop_transfer()
+                job.progress.fail()
+                delay = transfer_failed(budget, done > downloaded_size)
+                continue
+            job.progress.stop_transfer()
+            if done < total:
+                logging.debug('Connection closed early, resuming.')
+                job.progress.fail()
+                delay = transfer_failed(budget, done > downloaded_size)
+                continue
+            await asyncio.to_thread(index.remove)
+            if time.time() > start:
+                await asyncio.to_thread(
+                    get_proxy_store().record_throughput,
+                    proxy, (total - downloaded_size) / (time.time() - start))
+            await asyncio.to_thread(os.rename, job.dl_directory + '/' + name,
+                                    job.dl_directory + '/' + name[:-11])
+            breaker.record_success()
+            job.proxies.release(proxy, SUCCESS)
+            job.progress.update(status='Complete')
+            job.complete = True
+            return None
+        return job.dl_name
+
+    async def write_out(self, f, buffer, index=None, done=0, tail_block=0):
+        '''
+        Write and empty `buffer` off the event loop, then checkpoint `index`
+        at `done` bytes when given.
+        '''
+        if buffer:
+            await asyncio.to_thread(f.write, buffer)
+            buffer.clear()
+        if index:
+            await asyncio.to_thread(index.checkpoint, f, done, tail_block)
+
+    def file_name(self, job, rx):
+        name = rx.headers['Content-Disposition'].split('"')[1]
+        if os.path.exists(f'{job.dl_directory}/{name}'):
+            i = 1
+            while os.path.exists(f'{job.dl_directory}/({i}) {name}'):
+                i += 1
+            name = f'({i}) {name}'
+        return f'{name}.unfinished'
@@ -0,0 +1,189 @@
+import re
+import time
+import heapq
+import logging
+import threading
+
+# Seconds of unused bandwidth that may be spent at once
+BURST = 0.5
+# Longest single wait, so rate changes are noticed quickly
+MAX_WAIT = 0.25
+# Priority weights offered in the GUI
+PRIORITIES = {'Low': 0.25, 'Normal': 1.0, 'High': 4.0}
+
+UNITS = {'': 1, 'B': 1, 'K': 1024, 'KB': 1024, 'M': 1024 ** 2, 'MB': 1024 ** 2,
+         'G': 1024 ** 3, 'GB': 1024 ** 3}
+
+
+def parse_rate(text) -> int:
+    '''
+    '512K', '2M', '1.5MB' or a plain number of bytes per second. 0 = unlimited.
+    '''
+    match = re.fullmatch(r'\s*([\d.]+)\s*([KMG]?B?)\s*(?:/s)?\s*', str(text), re.I)
+    if not match:
+        raise ValueError(f'Invalid rate: {text}')
+    return int(float(match[1]) * UNITS[match[2].upper()])
+
+
+def parse_schedule(text) -> list:
+    '''
+    '08:00-23:00=512K; 23:00-08:00=0' -> [(start minute, end minute, rate)].
+    Windows may wrap past midnight, the first matching window wins.
+    '''
+    schedule = []
+    for part in re.split(r'[;,\n]', text or ''):
+        if not part.strip():
+            continue
+        match = re.fullmatch(
+            r'\s*(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})\s*=\s*(.+)', part)
+        if not match:
+            raise ValueError(f'Invalid schedule entry: {part.strip()}')
+        start = int(match[1]) * 60 + int(match[2])
+        end = int(match[3]) * 60 + int(match[4])
+        if start >= 24 * 60 or end > 24 * 60:
+            raise ValueError(f'Invalid time in schedule entry: {part.strip()}')
+        schedule.append((start, end, parse_rate(match[5])))
+    return schedule
+
+
+class BandwidthScheduler:
+    '''
+    Token bucket shared by every transfer loop.
+    Transfers call `acquire(n, weight, key)` before writing n bytes. While
+    the link is saturated, waiting transfers are served by start-time fair
+    queueing, so a job of weight 4 gets four times the bytes of a job of
+    weight 1, and bandwidth a job cannot use goes to the others.
+    The cap is `rate` bytes/s (0 = unlimited) unless a `schedule`
+    window covers the current local time.
+    '''
+
+    def __init__(self, rate=0, schedule=None):
+        self.rate = rate
+        self.schedule = schedule or []
+        self.cond = threading.Condition()
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self.vclock = 0.0
+        self.finish = {}
+        self.waiters = []
+        self.counter = 0
+
+    def configure(self, rate=0, schedule=None):
+        with self.cond:
+            self.rate = rate
+            self.schedule = schedule or []
+            self.cond.notify_all()
+
+    def current_rate(self, now=None) -> int:
+        if self.schedule:
+            t = time.localtime(now)
+            minute = t.tm_hour * 60 + t.tm_min
+            for start, end, rate in self.schedule:
+                if start <= minute < end or (end <= start and (minute >= start or minute < end)):
+                    return rate
+        return self.rate
+
+    def _enqueue(self, n, weight, key):
+        # Called with self.cond held
+        start = max(self.vclock, self.finish.get(key, 0.0))
+        self.finish[key] = start + n / max(weight, 0.01)
+        if len(self.finish) > 4096:
+            self.finish = {k: v for k, v in self.finish.items() if v > self.vclock}
+        self.counter += 1
+        entry = (start, self.counter, n)
+        heapq.heappush(self.waiters, entry)
+        return entry
+
+    def _try(self, entry):
+        '''
+        Grant `entry` if it is first in line and the bucket is not in debt.
+        Returns 0 once granted, else how long to wait before trying again.
+        Called with self.cond held.
+        '''
+        rate = self.current_rate()
+        if not rate:
+            # Limit lifted while waiting
+            self._cancel(entry)
+            return 0
+        now = time.monotonic()
+        self.tokens = min(self.tokens + (now - self.updated) * rate, rate * BURST)
+        self.updated = now
+        if self.waiters[0] is not entry:
+            # Not before the debt and the chunk of the first in line are paid
+            return min((max(-self.tokens, 0) + self.waiters[0][2]) / rate, MAX_WAIT)
+        if self.tokens < 0:
+            return min(-self.tokens / rate, MAX_WAIT)
+        heapq.heappop(self.waiters)
+        # Chunks larger than the bucket leave it in debt
+        self.tokens -= entry[2]
+        self.vclock = entry[0]
+        self.cond.notify_all()
+        return 0
+
+    def _cancel(self, entry):
+        # Called with self.cond held
+        if entry in self.waiters:
+            self.waiters.remove(entry)
+            heapq.heapify(self.waiters)
+            self.cond.notify_all()
+
+    def acquire(self, n, weight=1.0, key=None):
+        '''
+        Block until `n` bytes may be transferred.
+        '''
+        if not self.current_rate():
+            return
+        with self.cond:
+            entry = self._enqueue(n, weight, key)
+            granted = False
+            try:
+                while not granted:
+                    wait = self._try(entry)
+                    granted = not wait
+                    if wait:
+                        self.cond.wait(wait)
+            finally:
+                if not granted:
+                    self._cancel(entry)
+
+    async def acquire_async(self, n, weight=1.0, key=None):
+        '''
+        acquire() for coroutines, sleeps instead of blocking the loop.
+        '''
+        if not self.current_rate():
+            return
+        import asyncio
+        with self.cond:
+            entry = self._enqueue(n, weight, key)
+        granted = False
+        try:
+            while not granted:
+                with self.cond:
+                    wait = self._try(entry)
+                granted = not wait
+                if wait:
+                    await asyncio.sleep(wait)
+        finally:
+            if not granted:
+                # The task was cancelled while queued
+                with self.cond:
+                    self._cancel(entry)
+
+
+bandwidth = BandwidthScheduler()
+
+
+def apply_settings(settings):
+    '''
+    Configure the shared scheduler from app/settings
+    (7: rate limit, 8: schedule). Invalid values leave the link unlimited.
+    '''
+    rate, schedule = 0, []
+    try:
+        if settings and len(settings) > 7 and settings[7]:
+            rate = parse_rate(settings[7])
+        if settings and len(settings) > 8 and settings[8]:
+            schedule = parse_schedule(settings[8])
+    except ValueError as e:
+        logging.warning(e)
+    bandwidth.configure(rate, schedule)
@@ -0,0 +1,125 @@
+import time
+import logging
+import threading
+from .helpers import convert_size
+
+# Seconds between two decisions
+INTERVAL = 15
+# Share of broken transfers that halves the concurrency
+FAILURE_THRESHOLD = 0.3
+# Throughput gain (fraction) an extra download must bring to be kept
+MIN_GAIN = 0.05
+# Seconds before growing again after backing off
+PROBE_DELAY = 120
+
+
+class AdaptiveConcurrency:
+    '''
+    AIMD controller for DownloadEngine.max_workers.
+    Every `interval` seconds it measures the aggregate throughput and the
+    share of transfers that broke off, then adds one download while that
+    still raises throughput, halves the count when transfers fail, and
+    steps back when the last increase brought nothing. After backing off
+    it holds for PROBE_DELAY seconds before probing upwards again.
+    Decisions are logged and kept in `decision` for the UI.
+    '''
+
+    def __init__(self, engine, min_workers=1, max_workers=8, interval=INTERVAL,
+                 on_decision=None):
+        self.engine = engine
+        self.min_workers = max(int(min_workers), 1)
+        self.max_workers = max(int(max_workers), self.min_workers)
+        self.interval = interval
+        self.on_decision = on_decision
+        self.decision = ''
+        self.last_counts = {}
+        self.last_throughput = None
+        self.last_action = None
+        self.hold_until = 0
+        self.stopped = True
+        # Set to end the running loop, each start() gets its own
+        self.halt = None
+        self.workers = self.min_workers
+        engine.set_max_workers(self.workers)
+
+    def set_bounds(self, min_workers, max_workers):
+        self.min_workers = max(int(min_workers), 1)
+        self.max_workers = max(int(max_workers), self.min_workers)
+        self._apply(min(max(self.workers, self.min_workers), self.max_workers),
+                    'bounds changed', None)
+
+    def start(self):
+        if self.stopped:
+            self.stopped = False
+            # One per run, so a loop stopped mid-wait ends even if restarted at once
+            self.halt = threading.Event()
+            threading.Thread(target=self._loop, args=(self.halt,), daemon=True).start()
+
+    def stop(self):
+        self.stopped = True
+        if self.halt:
+            self.halt.set()
+
+    def _loop(self, halt):
+        last = time.time()
+        while not halt.wait(self.interval):
+            now = time.time()
+            self.step(now - last)
+            last = now
+
+    def sample(self, elapsed):
+        '''
+        Returns (bytes per second, failure ratio, jobs waiting) since the last sample.
+        '''
+        with self.engine.lock:
+            jobs = list(self.engine.jobs)
+            waiting = len(self.engine.pending)
+        counts = {}
+        transferred = transfers = failures = 0
+        for job in jobs:
+            progress = job.progress
+            if progress is None:
+                continue
+            done, started, failed = self.last_counts.get(id(job), (progress.done, 0, 0))
+            # A restarted download counts from zero again
+            transferred += max(progress.done - done, 0)
+            transfers += progress.transfers - started
+            failures += progress.failures - failed
+            counts[id(job)] = (progress.done, progress.transfers, progress.failures)
+        self.last_counts = counts
+        ratio = failures / max(transfers, 1)
+        return transferred / max(elapsed, 0.001), ratio, waiting
+
+    def step(self, elapsed):
+        throughput, failure_ratio, waiting = self.sample(elapsed)
+        active = self.engine.active
+        previous = self.last_throughput
+        self.last_throughput = throughput
+        speed = f'{convert_size(int(throughput))}/s'
+
+        if failure_ratio > FAILURE_THRESHOLD and self.workers > self.min_workers:
+            self._apply(max(self.workers // 2, self.min_workers),
+                        f'{failure_ratio:.0%} of transfers failed at {speed}', 'decrease')
+        elif (self.last_action == 'increase' and previous
+              and throughput < previous * (1 + MIN_GAIN)):
+            self._apply(max(self.workers - 1, self.min_workers),
+                        f'no gain from the last increase, {speed}', 'decrease')
+        elif (waiting and active >= self.workers and self.workers < self.max_workers
+              and time.time() >= self.hold_until):
+            self._apply(self.workers + 1, f'{waiting} waiting, {speed}', 'increase')
+        else:
+            self.last_action = None
+            self.decision = f'{self.workers} parallel, {speed}'
+
+    def _apply(self, workers, reason, action):
+        self.last_action = action
+        if action == 'decrease':
+            self.hold_until = time.time() + PROBE_DELAY
+        changed = workers != self.workers
+        self.workers = workers
+        self.engine.set_max_workers(workers)
+        self.decision = f'{workers} parallel ({reason})'
+        if changed:
+            logging.info(f'Concurrency set to {workers}: {reason}')
+            if self.on_decision:
+                self.on_decision(workers, reason)
@@ -1,26 +1,34 @@
-import requests
 import os
+import re
 import time
-import lxml.html
 import logging
-import PyQt5.sip
-import queue
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from .bandwidth import bandwidth
 from .helpers import *
-import urllib3
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-proxy_queue = queue.Queue()
+from .metrics import RESOLUTIONS, RESOLVE_SECONDS, TTFB_SECONDS
+from .proxy_pool import COOLDOWN, FAILURE, SUCCESS
+from .proxy_store import get_proxy_store
+from .retry import RESOLVE, TRANSFER, breaker, policy, transfer_failed, wait_retry
+from .resume import (TAIL_BLOCK, ResumeError, ResumeIndex, TailCheck,
+                     check_content_range, resume_point)
+from .segments import SAVE_INTERVAL, SegmentMap, fetch_segments, preallocate
+from .sessions import get_session, session_pool
+from .tracing import span, traced
+DIRECT_LINK_XPATH = '/html/body/div[4]/div[2]/a'
+# 1fichier's free download limit per IP ("You must wait 12 minutes...")
+WAIT_PATTERN = re.compile(
+    r'(?:you must wait|vous devez attendre)\D{0,20}?(\d+)\s*(min|sec)', re.IGNORECASE)
+# Same limit when the page does not say how long
+LIMIT_MARKERS = ('one file at a time', 'un seul fichier à la fois')
 
 
 def wait_for_password(worker, password=''):
     status = 'Bad password' if password else 'Waiting for password'
     while True:
-        if not PyQt5.sip.isdeleted(worker.data[6]):
-            if worker.data[6].text() == password:
-                update_data = [None, None, status, None]
-                # Only if it is a list type update_signal
-                if isinstance(worker.data, list):
-                    worker.signals.update_signal.emit(
-                        worker.data, update_data)
+        current = worker.get_password()
+        if current is not None:
+            if current == password:
+                worker.progress.update(status=status)
                 time.sleep(2)
             else:
                 return True
@@ -28,7 +36,138 @@ def wait_for_password(worker, password=''):
             return False
 
 
-def download(worker, payload={'dl_no_ssl': 'on', 'dlinline': 'on'}, downloaded_size=0):
+def wait_seconds(text):
+    '''
+    Seconds 1fichier makes the proxy's IP wait before its next download,
+    0 if the wait page does not say, None if `text` is not the wait page.
+    '''
+    match = WAIT_PATTERN.search(text)
+    if match:
+        return int(match[1]) * (60 if match[2].lower() == 'min' else 1)
+    if any(marker in text for marker in LIMIT_MARKERS):
+        return 0
+    return None
+
+
+def no_link_outcome(text):
+    '''
+    (outcome, wait) to release a proxy whose page had no direct link with:
+    COOLDOWN on the wait page, FAILURE for anything else (block pages,
+    captchas, junk), so such proxies get struck out.
+    '''
+    wait = wait_seconds(text)
+    return (FAILURE, None) if wait is None else (COOLDOWN, wait)
+
+
+def resolution_outcome(r, html) -> str:
+    '''
+    Label of a download form answer in the resolution metrics.
+    '''
+    if html.xpath(DIRECT_LINK_XPATH):
+        return 'link'
+    if 'Bad password' in r.text:
+        return 'bad_password'
+    if wait_seconds(r.text) is not None:
+        return 'wait'
+    return 'no_link'
+
+
+def post_form(worker, url, payload, headers, proxies):
+    '''
+    Send the download form to `url` through `proxies`, on the proxy's
+    keep-alive session so the following requests reuse the connection.
+    Re-sends it with the password when the file is protected.
+    The outcome is recorded in the proxy reputation store.
+    Returns (response, parsed html).
+    '''
+    import lxml.html
+    session = get_session(proxies)
+    start = time.time()
+    try:
+        with span('post', proxy=proxies.get('https')):
+            r = session.post(url, payload, headers=headers,
+                             proxies=proxies, timeout=worker.timeout, verify=False)
+        with span('parse'):
+            html = lxml.html.fromstring(r.content)
+    except Exception:
+        get_proxy_store().record_failure(proxies)
+        session_pool.discard(proxies)
+        RESOLUTIONS.inc(outcome='error')
+        raise
+    get_proxy_store().record_success(proxies, time.time() - start)
+    RESOLVE_SECONDS.observe(time.time() - start)
+    if r.status_code >= 500:
+        # Answered through a working proxy, so 1fichier itself is failing
+        breaker.record_failure()
+    if html.xpath('//*[@id="pass"]'):
+        # A copy, racers and other jobs post the same form at once
+        payload = dict(payload, **{'pass': worker.get_password()})
+        with span('post', proxy=proxies.get('https'), password=True):
+            r = session.post(url, payload, proxies=proxies,
+                             timeout=worker.timeout, verify=False)
+        with span('parse'):
+            html = lxml.html.fromstring(r.content)
+    RESOLUTIONS.inc(outcome=resolution_outcome(r, html))
+    return r, html
+
+
+def race_proxies(worker, url, payload, headers, attempts):
+    '''
+    Send the download form through `worker.race_count` proxies at once.
+    The first page holding the direct link (or a bad password notice) wins,
+    pending attempts are cancelled and proxies still in flight are given back.
+    Returns (proxy, response, html, attempts), proxy is None if all failed;
+    the winning proxy stays leased.
+    '''
+    racers = {}
+    with span('proxy'):
+        # Races whatever the pool holds rather than waiting for race_count
+        proxies = worker.proxies.lease_many(worker, worker.race_count)
+    if not proxies:
+        return None, None, None, attempts
+    executor = ThreadPoolExecutor(max_workers=len(proxies))
+    for p in proxies:
+        racers[executor.submit(
+            post_form, worker, url, payload, headers, p)] = p
+
+    winner = None
+    finished = set()
+    try:
+        for future in as_completed(racers):
+            finished.add(future)
+            p = racers[future]
+            proxy_ip = str(p['https']) if isinstance(p['https'], str) else ''
+            try:
+                r, html = future.result()
+            except Exception as e:
+                logging.debug('Proxy failed. \n'+f'{e}')
+                worker.proxies.release(p, FAILURE)
+            else:
+                if html.xpath(DIRECT_LINK_XPATH) or 'Bad password' in r.text:
+                    winner = (p, r, html)
+                    break
+                outcome, wait = no_link_outcome(r.text)
+                logging.debug(f'Proxy answered without a direct link (wait: {wait}).')
+                worker.proxies.release(p, outcome, wait)
+            attempts += 1
+            worker.progress.update(
+                status=f'Bypassing ({attempts})', proxy=proxy_ip)
+            if worker.stopped or worker.paused:
+                break
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        for future, p in racers.items():
+            # Losers that never answered were not proven dead.
+            if future not in finished:
+                worker.proxies.release(p)
+
+    if winner:
+        return (*winner, attempts)
+    return None, None, None, attempts
+
+
+@traced('download')
+def download(worker, payload=None, downloaded_size=0):
     '''
     Name is self-explanatory.
     1 - Get direct 1Fichier link using proxies.
@@ -37,6 +176,8 @@ def download(worker, payload={'dl_no_ssl': 'on', 'dlinline': 'on'}, downloaded_s
     downloading = True
     url = worker.link
     i = 0
+    if payload is None:
+        payload = {'dl_no_ssl': 'on', 'dlinline': 'on'}
 
     headers_opt = {
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/116.0.0.0 Safari/537.36 Edg/116.0.1938.54',
@@ -51,80 +192,142 @@ def download(worker, payload={'dl_no_ssl': 'on', 'dlinline': 'on'}, downloaded_s
         'Referer': url,
     }
 
+    tail_block = TAIL_BLOCK if worker.verify_tail else 0
+    segment_map = None
+    # Expected size and checksum of the block before downloaded_size
+    expected_total = tail = None
     if worker.dl_name:
-        try:
-            downloaded_size = os.path.getsize(
-                worker.dl_directory + '/' + worker.dl_name)
-            logging.debug(
-                f'Previous file found. Downloaded size: {downloaded_size}')
-        except FileNotFoundError:
-            downloaded_size = 0
-            logging.debug('Previous file not found.')
+        segment_map = SegmentMap.load(
+            worker.dl_directory + '/' + worker.dl_name)
+    if segment_map:
+        # The file is preallocated, its size says nothing about progress
+        downloaded_size = 0
+        expected_total = segment_map.total
+        logging.debug(
+            f'Previous segments found. Downloaded size: {segment_map.done_bytes()}')
+    elif worker.dl_name:
+        downloaded_size, expected_total, tail = resume_point(
+            worker.dl_directory + '/' + worker.dl_name, tail_block)
+        logging.debug(
+            f'Previous file found. Verified size: {downloaded_size}')
 
+    def saved_bytes():
+        # Bytes of the file already on disk
+        return segment_map.done_bytes() if segment_map else downloaded_size
+
+    budget = policy.budget()
+    # Backoff before the next attempt, set by budget.fail()
+    delay = 0.0
+    p = None
     while downloading:
-        p = None
+        if p:
+            # Not proven good or bad by the previous attempt
+            worker.proxies.release(p)
+            p = None
         if worker.stopped or worker.paused:
             return None if not worker.dl_name else worker.dl_name
-        if not wait_for_password(worker):
-            return
-        if (isinstance(worker.data, list)):
-            update_data = [None, None, f'Bypassing ({i})', 'Change Proxy'] if i != 0 else [
-                None, None, f'Loading', 'Viewing']
-            worker.signals.update_signal.emit(worker.data, update_data)
-            time.sleep(1)
-
-        p = worker.proxies.get()
+        with span('password'):
+            if not wait_for_password(worker):
+                return
+        with span('backoff', seconds=round(delay, 2)):
+            if not wait_retry(worker, delay, budget):
+                return None if not worker.dl_name else worker.dl_name
+        delay = 0.0
+        if i != 0:
+            worker.progress.update(
+                status=f'Bypassing ({i})', proxy='Change Proxy')
+        else:
+            worker.progress.update(status='Loading', proxy='Viewing')
 
-        try:
+        if worker.race_count > 1:
+            tried = i
+            with span('race', racers=worker.race_count):
+                p, r, html, i = race_proxies(
+                    worker, url, payload, headers_opt, i)
             if not p:
-                p = worker.proxies.get()
-            proxy_ip = str(p['https']) if isinstance(p['https'], str) else ''
-            if (isinstance(worker.data, list)):
-                update_data = [
-                    None, None, f'Bypassing ({i})', str(proxy_ip)] if i != 0 else [
-                    None, None, f'Proxy renewal', 'Viewing']
-                if isinstance(worker.data, list):
-                    worker.signals.update_signal.emit(
-                        worker.data, update_data)
-
-            # Get download link
-            r = requests.post(url, payload, headers=headers_opt,
-                              proxies=p, timeout=worker.timeout, verify=False)
-            time.sleep(1)
-            html = lxml.html.fromstring(r.content)
-            if html.xpath('//*[@id="pass"]'):
-                payload['pass'] = worker.data[6].text()
-                r = requests.post(url, payload, proxies=p,
-                                  timeout=worker.timeout, verify=False)
-        except Exception as e:
-            logging.debug('Proxy failed. \n'+f'{e}')
-            i += 1
-            continue
+                if worker.stopped or worker.paused:
+                    continue
+                delay = budget.fail(RESOLVE, max(i - tried, 1))
+                continue
         else:
-            logging.debug('Proxy worked.')
-            if worker.stopped or worker.paused:
-                return None if not worker.dl_name else worker.dl_name
+            with span('proxy'):
+                p = worker.proxies.lease(worker)
+            if p is None:
+                # Stopped or paused while waiting for a proxy
+                continue
+
+            try:
+                proxy_ip = str(p['https']) if isinstance(p['https'], str) else ''
+                if i != 0:
+                    worker.progress.update(
+                        status=f'Bypassing ({i})', proxy=str(proxy_ip))
+                else:
+                    worker.progress.update(
+                        status='Proxy renewal', proxy='Viewing')
+
+                # Get download link
+                r, html = post_form(worker, url, payload, headers_opt, p)
+            except Exception as e:
+                logging.debug('Proxy failed. \n'+f'{e}')
+                worker.proxies.release(p, FAILURE)
+                p = None
+                i += 1
+                delay = budget.fail(RESOLVE)
+                continue
+
+        logging.debug('Proxy worked.')
+        if worker.stopped or worker.paused:
+            return None if not worker.dl_name else worker.dl_name
 
-            if (isinstance(worker.data, list)):
-                update_data = [None, None, '우회 성공', None]
-                worker.signals.update_signal.emit(
-                    worker.data, update_data)
+        worker.progress.update(status='우회 성공')
 
-        if not html.xpath('/html/body/div[4]/div[2]/a'):
+        if not html.xpath(DIRECT_LINK_XPATH):
             logging.debug('Failed to parse direct link.')
             if 'Bad password' in r.text:
-                if not wait_for_password(worker, payload['pass']):
-                    return
+                worker.proxies.release(p, SUCCESS)
+                p = None
+                with span('password', bad=True):
+                    if not wait_for_password(worker, worker.get_password()):
+                        return
+            else:
+                # Most often the per-IP wait: the proxy is fine, just not now
+                outcome, wait = no_link_outcome(r.text)
+                if outcome == COOLDOWN:
+                    logging.debug(f'Proxy has to wait {wait}s before the next download.')
+                    # Answered, so the next proxy needs no backoff
+                    budget.succeed(RESOLVE)
+                worker.proxies.release(p, outcome, wait)
+                p = None
+                delay = budget.fail(RESOLVE)
         else:
             logging.debug('Parsed direct link.')
+            budget.succeed(RESOLVE)
             old_url = url
-            urlx = html.xpath('/html/body/div[4]/div[2]/a')[0].get('href')
+            urlx = html.xpath(DIRECT_LINK_XPATH)[0].get('href')
             logging.debug('Parsed urlx Check: '+str(urlx))
             headers_opt['Referer'] = old_url
-            headers_opt['Range'] = f'bytes={downloaded_size}-'
+            # Ask again for the block before the resume point to check it
+            overlap = min(tail_block, downloaded_size) if tail else 0
+            headers_opt['Range'] = f'bytes={downloaded_size - overlap}-'
 
-            rx = requests.get(urlx, stream=True, headers=headers_opt,
-                              proxies=p, verify=False)
+            requested = time.time()
+            try:
+                with span('connect', range=headers_opt['Range']):
+                    rx = get_session(p).get(urlx, stream=True, headers=headers_opt,
+                                            proxies=p, timeout=worker.timeout, verify=False)
+            except Exception as e:
+                # The proxy just worked, the site is the one failing
+                logging.debug('Direct link failed. \n'+f'{e}')
+                breaker.record_failure()
+                delay = budget.fail(TRANSFER)
+                continue
+            TTFB_SECONDS.observe(time.time() - requested)
+            if rx.status_code >= 500:
+                logging.debug(f'Direct link answered {rx.status_code}.')
+                rx.close()
+                breaker.record_failure()
+                delay = budget.fail(TRANSFER)
+                continue
 
             if 'Content-Disposition' in rx.headers:
                 logging.debug('Starting download.')
@@ -144,46 +347,150 @@ def download(worker, payload={'dl_no_ssl': 'on', 'dlinline': 'on'}, downloaded_s
                 worker.dl_name = name
 
                 if worker.stopped or worker.paused:
+                    rx.close()
                     return name
-                # Prevent update kinks when asynchronous
-                if (isinstance(worker.data, list)):
-                    update_data = [
-                        name[:-11], convert_size(float(rx.headers['Content-Length'])+downloaded_size)]
-                    worker.signals.update_signal.emit(
-                        worker.data, update_data)
-
-                with open(worker.dl_directory + '/' + name, 'ab') as f:
-                    if (isinstance(worker.data, list)):
-                        update_data = [None, None, 'Downloading', None]
-                        if isinstance(worker.data, list):
-                            worker.signals.update_signal.emit(
-                                worker.data, update_data)
-                    chunk_size = 8192
-                    bytes_read = 0
+
+                path = worker.dl_directory + '/' + name
+                saved = saved_bytes()
+                try:
+                    if rx.status_code == 206:
+                        total = check_content_range(
+                            rx, downloaded_size - overlap, expected_total)
+                    else:
+                        total = int(rx.headers['Content-Length'])
+                        if downloaded_size or segment_map:
+                            # Range ignored, the body is the whole file
+                            logging.debug('Range ignored, restarting download from the start.')
+                            discard_partial(path, segment_map)
+                            segment_map = None
+                            downloaded_size = overlap = 0
+                    check = TailCheck(overlap, tail) if overlap else None
+                    expected_total = total
+                    worker.progress.update(name=name[:-11], size=convert_size(total))
+
                     start = time.time()
-                    for chunk in rx.iter_content(chunk_size):
-                        f.write(chunk)
-                        bytes_read += len(chunk)
-                        total_per = 100 * (float(bytes_read) + downloaded_size)
-                        total_per /= float(rx.headers['Content-Length']
-                                           ) + downloaded_size
-                        dl_speed = download_speed(bytes_read, start)
-                        if worker.stopped or worker.paused:
+                    if rx.status_code == 206 and (segment_map or worker.segment_count > 1):
+                        if not segment_map:
+                            if check:
+                                # The re-sent block still proves the file on disk
+                                check.verify(rx.iter_content(8192))
+                            ResumeIndex(path).remove()
+                            segment_map = SegmentMap.plan(
+                                path, total, worker.segment_count, downloaded_size)
+                            preallocate(path, segment_map.total)
+                        rx.close()
+                        start_size = segment_map.done_bytes()
+                        worker.progress.start_transfer(segment_map.total, start_size)
+                        with span('transfer', segments=len(segment_map.segments)):
+                            fetched = fetch_segments(worker, urlx, headers_opt, [p], segment_map,
+                                                     max(worker.segment_count, 1),
+                                                     worker.progress.set_done)
+                        if not fetched:
+                            worker.progress.stop_transfer()
+                            if worker.stopped or worker.paused:
+                                return name
+                            logging.debug('Segments failed. Restarting download.')
+                            worker.progress.fail()
+                            delay = transfer_failed(budget, saved_bytes() > saved)
+                            continue
+                        bytes_read = segment_map.total - start_size
+                    else:
+                        with span('transfer', offset=downloaded_size):
+                            bytes_read = stream_download(
+                                worker, rx, path, downloaded_size, total, check)
+                        worker.progress.stop_transfer()
+                        if bytes_read is None:
                             return name
-                        if (isinstance(worker.data, list)):
-                            update_data = [None, None, 'Downloading', None,
-                                           dl_speed, round(total_per, 1)]
-                            worker.signals.update_signal.emit(
-                                worker.data, update_data)
+                        if downloaded_size + bytes_read < total:
+                            logging.debug('Connection closed early, resuming.')
+                            worker.progress.fail()
+                            downloaded_size, expected_total, tail = resume_point(
+                                path, tail_block)
+                            delay = transfer_failed(budget, bytes_read > 0)
+                            continue
+                        ResumeIndex(path).remove()
+                except ResumeError as e:
+                    # Resuming would corrupt the file, only a full download is safe
+                    logging.debug(f'{e}. Restarting download from the start.')
+                    rx.close()
+                    worker.progress.stop_transfer()
+                    discard_partial(path, segment_map)
+                    segment_map = None
+                    downloaded_size = 0
+                    expected_total = tail = None
+                    delay = budget.fail(TRANSFER)
+                    continue
+                except OSError as e:
+                    # Connection lost mid-transfer (requests errors are OSErrors)
+                    logging.debug(f'Transfer failed: {e}. Resuming.')
+                    rx.close()
+                    worker.progress.stop_transfer()
+                    worker.progress.fail()
+                    if not segment_map:
+                        downloaded_size, expected_total, tail = resume_point(
+                            path, tail_block)
+                    delay = transfer_failed(budget, saved_bytes() > saved)
+                    continue
+                if bytes_read and time.time() > start:
+                    get_proxy_store().record_throughput(
+                        p, bytes_read / (time.time() - start))
                 os.rename(worker.dl_directory + '/' + name,
                           worker.dl_directory + '/' + name[:-11])
 
-                update_data = [None, None, 'Complete', None]
-                if isinstance(worker.data, list):
-                    worker.signals.update_signal.emit(
-                        worker.data, update_data)
+                breaker.record_success()
+                worker.proxies.release(p, SUCCESS)
+                worker.progress.update(status='Complete')
                 downloading = False
             else:
+                rx.close()
                 logging.debug(
                     'No Content-Disposition header. Restarting download.')
+                delay = budget.fail(TRANSFER)
     return
+
+
+def discard_partial(path, segment_map=None):
+    '''
+    Empty a partial file that cannot be resumed safely, with its sidecars.
+    '''
+    ResumeIndex(path).remove()
+    if segment_map:
+        segment_map.remove()
+    open(path, 'wb').close()
+
+
+def stream_download(worker, rx, path, downloaded_size, total, check=None):
+    '''
+    Write the body of `rx` to `path` from byte `downloaded_size` over a
+    single connection, recording verified progress in a ResumeIndex.
+    `check` (TailCheck) validates the re-sent block before anything is
+    written and raises ResumeError if it differs.
+    Returns the number of bytes read, or None when stopped or paused.
+    '''
+    tail_block = TAIL_BLOCK if worker.verify_tail else 0
+    index = ResumeIndex(path, total, downloaded_size)
+    worker.progress.start_transfer(total, downloaded_size)
+    mode = 'r+b' if downloaded_size and os.path.exists(path) else 'wb'
+    with open(path, mode) as f:
+        # Bytes after the verified size may not have reached the disk
+        f.truncate(downloaded_size)
+        f.seek(downloaded_size)
+        chunk_size = 8192
+        bytes_read = 0
+        saved = time.time()
+        for chunk in rx.iter_content(chunk_size):
+            if check:
+                chunk = check.feed(chunk)
+            bandwidth.acquire(len(chunk), worker.priority, worker)
+            f.write(chunk)
+            bytes_read += len(chunk)
+            worker.progress.add(len(chunk))
+            if worker.stopped or worker.paused:
+                index.checkpoint(f, downloaded_size + bytes_read, tail_block)
+                return None
+            if time.time() - saved > SAVE_INTERVAL:
+                index.checkpoint(f, downloaded_size + bytes_read, tail_block)
+                saved = time.time()
+        if downloaded_size + bytes_read < total:
+            index.checkpoint(f, downloaded_size + bytes_read, tail_block)
+    return bytes_read
@@ -0,0 +1,367 @@
+import os
+import time
+import logging
+import threading
+from .download import download
+from .bandwidth import apply_settings
+from .folders import iter_folder
+from .helpers import get_link_info, is_valid_link
+from .job_store import CHECKPOINT_INTERVAL
+from .metadata_cache import get_metadata_cache, ALIAS_TTL
+from .metrics import ACTIVE_JOBS, JOBS, PROXY_COOLING, PROXY_QUEUE, QUEUE_DEPTH
+from .progress import ProgressBus
+from .proxy_pool import proxy_pool
+from .resume import ResumeIndex
+from . import retry
+from .segments import SegmentMap
+from .tracing import traced
+
+# Password column value of files that are not protected
+NO_PASSWORD = 'No password'
+
+PROXY_QUEUE.set_function(proxy_pool.qsize)
+PROXY_COOLING.set_function(proxy_pool.cooling_count)
+
+
+def normalize_link(link: str) -> str:
+    '''
+    Bypass ouo.io shortened links and return a clean 1fichier link.
+    Raises ValueError if the link is not supported.
+    '''
+    link = link.strip()
+    # If the shortened URL is ouo bypass, recaptcha bypass
+    if 'ouo.io' in link or 'ouo.press' in link:
+        cache = get_metadata_cache()
+        bypassed = cache.get(link)
+        if not bypassed:
+            from .recapcha import ouo_bypass
+            try:
+                bypassed = ouo_bypass(url=link)['bypassed_link']
+            except Exception as e:
+                raise ValueError(f'Failed to bypass ouo.io link {link}: {e}')
+            if bypassed:
+                cache.put(link, bypassed, ALIAS_TTL)
+        link = bypassed
+        logging.debug('Bypassed link: ' + str(link))
+    if not link or not is_valid_link(link):
+        raise ValueError(f'Invalid link format: {link}')
+    if not (link.startswith('https://') or link.startswith('http://')):
+        link = f'https://{link}'
+    return link.split('&')[0]
+
+
+@traced('resolve_link', 'resolve')
+def resolve_link(link: str):
+    '''
+    Normalize `link` and fetch what the table shows about it.
+    Folder links give one entry per file, including subfolders,
+    streamed while the listings are read.
+    Returns an iterable of (link, name, size, is_private),
+    raises ValueError for bad links.
+    '''
+    link = normalize_link(link)
+    if '/dir/' in link:
+        return (entry for batch in iter_folder(link) for entry in batch)
+    name, size = get_link_info(link)
+    if name == 'Error':
+        raise ValueError(
+            f'We couldn\'t get the actual information for the file to download.\n{link}')
+    return [(link, name, size, name == 'Private File')]
+
+
+class DownloadJob:
+    '''
+    One file to download, without any Qt dependency.
+    `settings` is the list saved in app/settings.
+    '''
+
+    def __init__(self, link, settings=None, dl_name='', password=NO_PASSWORD, progress=None):
+        self.link = link
+        self.dl_name = dl_name
+        self.password = password
+        self.progress = progress
+        self.paused = self.stopped = self.complete = False
+        self.running = False
+        # Row of the job in the JobStore, if it is saved
+        self.job_id = None
+
+        # Default settings
+        self.timeout = 30
+        # Number of proxies raced at once to resolve the direct link (1 = off)
+        self.race_count = 4
+        # Parallel range requests per file (1 = single connection)
+        self.segment_count = 1
+        # Download the block before a resume point again and compare it
+        self.verify_tail = True
+        # Share of the bandwidth limit relative to other jobs
+        self.priority = 1.0
+
+        # Set user's download folder path
+        user_home_directory = os.path.expanduser("~")
+        self.dl_directory = os.path.join(user_home_directory, "Downloads")
+
+        # Proxies Settings
+        self.proxy_settings = None
+
+        # Override defaults
+        if settings:
+            if settings[0]:
+                self.dl_directory = settings[0]
+            if settings[2]:
+                self.timeout = settings[2]
+            if settings[3]:
+                self.proxy_settings = settings[3]
+            if len(settings) > 5 and settings[5]:
+                self.race_count = int(settings[5])
+            if len(settings) > 6 and settings[6]:
+                self.segment_count = int(settings[6])
+
+        # Proxies
+        self.proxies = proxy_pool
+
+    def get_password(self):
+        '''
+        Current password, None once the download is gone.
+        '''
+        return self.password
+
+    def run(self):
+        try:
+            dl_name = download(self)
+        finally:
+            # Proxies of an unfinished attempt go back to the pool
+            self.proxies.release_all(self)
+        self.dl_name = dl_name
+
+        if dl_name and self.stopped:
+            logging.debug('Stop Download')
+            try:
+                os.remove(self.dl_directory + '/' + str(dl_name))
+                logging.debug(
+                    f'Temp File Remove: {self.dl_directory}/{dl_name}')
+                SegmentMap(self.dl_directory + '/' +
+                           str(dl_name), 0, []).remove()
+                ResumeIndex(self.dl_directory + '/' + str(dl_name)).remove()
+            except:
+                logging.debug(
+                    f'Failed to remove: {self.dl_directory}/{dl_name}')
+
+        if not self.paused:
+            logging.debug('Remove Download')
+            if not dl_name:
+                self.complete = True
+
+    def stop(self):
+        self.stopped = True
+
+    def pause(self):
+        if not self.complete:
+            self.paused = True
+
+    def resume(self):
+        self.paused = False
+
+
+class DownloadEngine:
+    '''
+    Runs DownloadJobs on background threads, `max_workers` at a time.
+    `on_progress(job, snapshot)` is called from the engine's publisher
+    thread every `interval` seconds for each job that changed.
+    With a JobStore `store`, jobs are saved when queued, checkpointed
+    while running and removed once finished or stopped.
+    '''
+
+    def __init__(self, settings=None, max_workers=1, on_progress=None, interval=0.5,
+                 store=None):
+        self.settings = settings
+        self.max_workers = max_workers
+        self.on_progress = on_progress
+        self.interval = interval
+        self.store = store
+        if settings:
+            apply_settings(settings)
+            retry.apply_settings(settings)
+        self.bus = ProgressBus()
+        self.lock = threading.Condition()
+        self.pending = []
+        self.jobs = []
+        self.active = 0
+        self.closed = False
+        QUEUE_DEPTH.set_function(lambda: len(self.pending))
+        ACTIVE_JOBS.set_function(lambda: self.active)
+        if on_progress:
+            threading.Thread(target=self._publish, daemon=True).start()
+        if store:
+            threading.Thread(target=self._checkpoint_loop, daemon=True).start()
+
+    def _publish(self):
+        while not self.closed:
+            time.sleep(self.interval)
+            self._flush()
+
+    def _checkpoint_loop(self):
+        while not self.closed:
+            time.sleep(CHECKPOINT_INTERVAL)
+            with self.lock:
+                running = [job for job in self.jobs if job.running]
+            self.checkpoint(running)
+
+    def checkpoint(self, jobs=None):
+        '''
+        Save the byte counts of `jobs` (every unfinished job by default).
+        Jobs that have not transferred anything this session are skipped,
+        their saved counts are still the latest.
+        '''
+        if not self.store:
+            return
+        if jobs is None:
+            jobs = self.unfinished()
+        self.store.checkpoint([
+            (job.progress.done, job.progress.total, job.progress.status or 'Waiting',
+             job.dl_name or None, job.job_id)
+            for job in jobs
+            if job.job_id is not None and job.progress and job.progress.total])
+
+    def _flush(self):
+        for job, snapshot in self.bus.collect():
+            try:
+                self.on_progress(job, snapshot)
+            except Exception as e:
+                logging.error(f'Progress callback failed: {e}')
+
+    def enqueue(self, link, password=None, dl_name=''):
+        '''
+        Check `link` and queue its download(s).
+        Folder links queue one job per file.
+        Returns the list of new jobs, raises ValueError for bad links.
+        '''
+        entries = resolve_link(link)
+
+        jobs = []
+        for file_link, name, size, is_private in entries:
+            if is_private:
+                job_password = password if password else ''
+            else:
+                job_password = NO_PASSWORD
+            job = DownloadJob(file_link, self.settings, dl_name, job_password)
+            job.progress = self.bus.track(job)
+            job.progress.update(name=dl_name or name, size=size, status='Waiting')
+            jobs.append(self.submit(job))
+        return jobs
+
+    def submit(self, job):
+        '''
+        Queue an already built job (the GUI builds its own).
+        '''
+        if job.progress is None:
+            job.progress = self.bus.track(job)
+        if self.store and job.job_id is None:
+            password = job.password if job.password != NO_PASSWORD else None
+            job.job_id = self.store.add(job.link, job.progress.name, job.progress.size,
+                                        job.dl_name, password)
+        # Returns at once, the pool refills on a background thread
+        proxy_pool.refill(job.proxy_settings)
+        with self.lock:
+            self.jobs.append(job)
+            self.pending.append(job)
+            self._start_next()
+        return job
+
+    def set_max_workers(self, max_workers):
+        with self.lock:
+            self.max_workers = max(int(max_workers), 1)
+            self._start_next()
+
+    def set_priority(self, job, weight):
+        '''
+        Bandwidth weight of `job` while the limit is reached (1 = normal).
+        '''
+        job.priority = weight
+
+    def set_password(self, job, password):
+        job.password = password
+        if self.store and job.job_id is not None:
+            self.store.set_password(job.job_id, password)
+
+    def pause(self, job):
+        job.pause()
+
+    def resume(self, job):
+        with self.lock:
+            if not job.paused:
+                return
+            job.resume()
+            if not job.running and job not in self.pending:
+                self.pending.append(job)
+                self._start_next()
+
+    def stop(self, job):
+        job.stop()
+        with self.lock:
+            if job in self.pending:
+                self.pending.remove(job)
+            if job in self.jobs:
+                self.jobs.remove(job)
+        if job.progress:
+            self.bus.untrack(job.progress.key)
+        if self.store and job.job_id is not None:
+            self.store.remove(job.job_id)
+
+    def _start_next(self):
+        # Called with self.lock held
+        while self.pending and self.active < self.max_workers:
+            job = self.pending.pop(0)
+            if job.stopped:
+                continue
+            job.running = True
+            self.active += 1
+            threading.Thread(target=self._run, args=(job,), daemon=True).start()
+
+    def _run(self, job):
+        failed = False
+        try:
+            job.run()
+        except retry.RetryError as e:
+            failed = True
+            logging.info(f'Gave up on {job.link}: {e}')
+            job.progress.stop_transfer(str(e))
+            JOBS.inc(result='failed')
+        except Exception as e:
+            failed = True
+            logging.exception(e)
+            job.progress.stop_transfer('Error')
+            job.progress.fail()
+            JOBS.inc(result='failed')
+        if job.complete:
+            JOBS.inc(result='complete')
+        if self.store and job.job_id is not None:
+            if job.complete or job.stopped:
+                self.store.remove(job.job_id)
+            else:
+                self.checkpoint([job])
+        with self.lock:
+            job.running = False
+            self.active -= 1
+            # Resumed before the previous run noticed the pause
+            if not (failed or job.complete or job.paused or job.stopped):
+                self.pending.append(job)
+            self._start_next()
+            self.lock.notify_all()
+
+    def unfinished(self):
+        with self.lock:
+            return [job for job in self.jobs if not (job.complete or job.stopped)]
+
+    def wait(self):
+        '''
+        Block until no job is queued or running.
+        '''
+        with self.lock:
+            while self.pending or self.active:
+                self.lock.wait()
+
+    def close(self):
+        self.closed = True
+        if self.on_progress:
+            self._flush()
+        self.checkpoint()
@@ -0,0 +1,165 @@
+import json
+import queue
+import codecs
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .helpers import convert_size
+from .metadata_cache import get_metadata_cache, cache_key, FOLDER_TTL
+from .sessions import get_session
+
+# Subfolders listed at the same time
+FOLDER_WORKERS = 4
+# Files handed over together
+FOLDER_BATCH = 200
+# Listings longer than this are streamed but not cached
+MAX_CACHED_FOLDER = 1000
+# Size of the pieces read from a listing response
+CHUNK_SIZE = 64 * 1024
+
+
+def iter_json_array(chunks):
+    '''
+    Yield the items of a top level JSON array read from text `chunks`,
+    holding at most one item and one chunk in memory.
+    '''
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = False
+    for chunk in chunks:
+        buffer += chunk
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos == len(buffer):
+                break
+            if not started:
+                if buffer[pos] != '[':
+                    raise ValueError('Folder listing is not a JSON array')
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == ']':
+                return
+            try:
+                item, pos = decoder.raw_decode(buffer, pos)
+            except ValueError:
+                # Item not complete yet
+                break
+            yield item
+        buffer = buffer[pos:]
+    raise ValueError('Folder listing ended early')
+
+
+def folder_entry(f) -> tuple:
+    '''
+    (link, name, size, is_private) of one item of a `?json=1` listing.
+    Subfolders have a /dir/ link.
+    '''
+    size = f.get('size')
+    return (f['link'], f.get('filename', ''),
+            convert_size(int(size)) if size is not None else '- MB',
+            f.get('password') == 1)
+
+
+def list_folder(link):
+    '''
+    Yield the entries of one folder (files and subfolders) as they
+    are parsed, from the metadata cache when possible.
+    '''
+    cache = get_metadata_cache()
+    cached = cache.get(link)
+    if cached is not None:
+        yield from (tuple(entry) for entry in cached)
+        return
+
+    keep = []
+    with get_session().get(f'{link}?json=1', stream=True, timeout=30) as r:
+        decoder = codecs.getincrementaldecoder(r.encoding or 'utf-8')()
+        chunks = (decoder.decode(chunk) for chunk in r.iter_content(CHUNK_SIZE))
+        for item in iter_json_array(chunks):
+            entry = folder_entry(item)
+            if keep is not None:
+                keep.append(entry)
+                if len(keep) > MAX_CACHED_FOLDER:
+                    keep = None
+            yield entry
+
+    if keep is not None:
+        cache.put(link, keep, FOLDER_TTL)
+        # Files of the folder are known now too
+        for f_link, name, size, is_private in keep:
+            if '/dir/' not in f_link:
+                cache.put(f_link, ['Private File', '- MB'] if is_private else [name, size])
+
+
+def iter_folder(link, workers=FOLDER_WORKERS, batch_size=FOLDER_BATCH):
+    '''
+    Yield lists of (link, name, size, is_private) for every file of
+    folder `link` and of its subfolders, `workers` folders at a time.
+    Listings are parsed as they arrive and producers wait while the
+    consumer is behind, so memory does not grow with the folder size.
+    A failure of `link` itself is raised, failing subfolders are skipped.
+    '''
+    out = queue.Queue(maxsize=2 * workers)
+    lock = threading.Lock()
+    seen = {cache_key(link)}
+    pending = 1
+    closed = False
+    executor = ThreadPoolExecutor(max_workers=workers)
+
+    def put(item):
+        while not closed:
+            try:
+                out.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                pass
+
+    def crawl(folder):
+        nonlocal pending
+        batch = []
+        try:
+            for entry in list_folder(folder):
+                if closed:
+                    return
+                if '/dir/' in entry[0]:
+                    key = cache_key(entry[0])
+                    with lock:
+                        if key in seen:
+                            continue
+                        seen.add(key)
+                        pending += 1
+                    executor.submit(crawl, entry[0])
+                    continue
+                batch.append(entry)
+                if len(batch) >= batch_size:
+                    put(batch)
+                    batch = []
+            if batch:
+                put(batch)
+        except Exception as e:
+            if folder == link:
+                put(e)
+            else:
+                logging.warning(f'Failed to list subfolder {folder}: {e}')
+        finally:
+            with lock:
+                pending -= 1
+                finished = pending == 0
+            if finished:
+                put(None)
+
+    executor.submit(crawl, link)
+    try:
+        while True:
+            item = out.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        closed = True
+        executor.shutdown(wait=False, cancel_futures=True)
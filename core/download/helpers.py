@@ -1,13 +1,11 @@
 import logging
 import random
-import requests
 import math
 import os
-import time
-import lxml.html
-import urllib3
-# SSL Ignore warning
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+import sys
+from .proxy_lists import NESTED_PREFIX, load_lists
+from .sessions import get_session
+from .tracing import traced
 
 FIRST_RUN = True
 SOCKS5_PROXY_TXT_API = 'https://raw.githubusercontent.com/leinad4mind/1fichier-dl/main/socks5_proxy_list.txt'
@@ -15,13 +13,24 @@ HTTPS_PROXY_TXT_API = 'https://raw.githubusercontent.com/leinad4mind/1fichier-dl
 PLATFORM = os.name
 
 
+def app_path(name: str) -> str:
+    '''
+    Path of `name` in the app/ folder (next to the exe when frozen).
+    '''
+    if getattr(sys, 'frozen', False):
+        app_dir = os.path.join(os.path.dirname(sys.executable), 'app')
+    else:
+        app_dir = os.path.abspath('app')
+    return os.path.join(app_dir, name)
+
+
 def get_proxies(settings):
     '''
     If there are saved proxy settings, apply them override the default proxy settings.
     '''
 
     if settings:
-        r_proxies = requests.get(settings).text.splitlines()
+        r_proxies = load_lists([settings])[settings]
     else:
         '''
         Socks5, https proxy server list in array form
@@ -31,30 +40,19 @@ def get_proxies(settings):
     return r_proxies
 
 
-def get_proxies_from_api(api_url):
-    proxy_list = []
-    try:
-        response = requests.get(api_url)
-        if response.status_code == 200:
-            proxy_list = response.text.splitlines()
-    except requests.RequestException as e:
-        logging.debug(f"Failed to get proxy list from {api_url}: {e}")
-    return proxy_list
-
-
-def process_proxy_list(proxy_list, proxy_type):
+def process_proxy_list(proxy_list, proxy_type, lists):
+    '''
+    Proxies of `proxy_list` tagged with `proxy_type`; entries pointing to
+    another list are replaced by its lines from `lists` ({url: lines}).
+    '''
     processed_proxies = []
     for proxy in list(set(proxy_list)):
         proxy_parts = proxy.split(':')
         proxy_without_country = proxy_parts[0] + ':' + proxy_parts[1]
 
-        if proxy.startswith('https://raw.github'):
-            raw_proxy_list = requests.get(proxy).text.splitlines()
-            process_inner_proxy = []
-            for item in raw_proxy_list:
-                process_inner_proxy.append(item)
+        if proxy.startswith(NESTED_PREFIX):
             # Remove any possible duplicates
-            unique_proxy_list = list(set(process_inner_proxy))
+            unique_proxy_list = list(set(lists.get(proxy, [])))
             for item in unique_proxy_list:
                 processed_proxies.append({'https': f'{proxy_type}://{item}'})
 
@@ -68,14 +66,15 @@ def process_proxy_list(proxy_list, proxy_type):
     return processed_proxies
 
 
+@traced('get_all_proxies', 'proxy')
 def get_all_proxies():
     all_proxies = []
 
-    socks5_proxy_list = get_proxies_from_api(SOCKS5_PROXY_TXT_API)
-    https_proxy_list = get_proxies_from_api(HTTPS_PROXY_TXT_API)
+    # Both lists and the lists they point to are fetched concurrently
+    lists = load_lists([SOCKS5_PROXY_TXT_API, HTTPS_PROXY_TXT_API])
 
-    all_proxies.extend(process_proxy_list(socks5_proxy_list, 'socks5'))
-    all_proxies.extend(process_proxy_list(https_proxy_list, 'http'))
+    all_proxies.extend(process_proxy_list(lists[SOCKS5_PROXY_TXT_API], 'socks5', lists))
+    all_proxies.extend(process_proxy_list(lists[HTTPS_PROXY_TXT_API], 'http', lists))
     # Shuffle
     random.shuffle(all_proxies)
     return all_proxies
@@ -95,35 +94,29 @@ def convert_size(size_bytes: int) -> str:
     return '%s %s' % (s, size_name[i])
 
 
-def download_speed(bytes_read: int, start_time: float) -> str:
-    '''
-    Convert speed to human readable speed (str).
-    '''
-    if bytes_read == 0:
-        return '0 B/s'
-    elif time.time()-start_time == 0:
-        return '- B/s'
-    size_name = ('B/s', 'KB/s', 'MB/s', 'GB/s', 'TB/s')
-    bps = bytes_read/(time.time()-start_time)
-    i = int(math.floor(math.log(bps, 1024)))
-    p = math.pow(1024, i)
-    s = round(bps / p, 2)
-    return '%s %s' % (s, size_name[i])
-
-
 def get_link_info(url: str) -> list:
     '''
     Get file name and size. 
+    Answers from the metadata cache (app/metadata.json) when it can.
     '''
+    from .metadata_cache import get_metadata_cache
+    cache = get_metadata_cache()
+    cached = cache.get(url)
+    if cached:
+        return cached
     try:
-        r = requests.get(url)
+        import lxml.html
+        r = get_session().get(url)
         html = lxml.html.fromstring(r.content)
         if html.xpath('//*[@id="pass"]'):
-            return ['Private File', '- MB']
-        name = html.xpath('//td[@class=\'normal\']')[0].text
-        size = html.xpath('//td[@class=\'normal\']')[2].text
+            info = ['Private File', '- MB']
+        else:
+            name = html.xpath('//td[@class=\'normal\']')[0].text
+            size = html.xpath('//td[@class=\'normal\']')[2].text
+            info = [name, size]
         r.close()
-        return [name, size]
+        cache.put(url, info)
+        return info
     except:
         logging.debug(__name__+' Exception')
         return ['Error', '- MB']
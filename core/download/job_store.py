@@ -0,0 +1,143 @@
+import os
+import time
+import pickle
+import logging
+import sqlite3
+import threading
+
+# How often running downloads write their byte count (seconds)
+CHECKPOINT_INTERVAL = 5
+
+COLUMNS = ('id', 'link', 'name', 'size', 'dl_name', 'password',
+           'status', 'done', 'total')
+
+
+def job_store_path():
+    '''
+    Path of the download queue database, next to the other app/ files.
+    '''
+    from .helpers import app_path
+    return app_path('jobs.db')
+
+
+class JobStore:
+    '''
+    Unfinished downloads (SQLite in WAL mode).
+    Every change is written as it happens, so a crash loses at most
+    the last few seconds of progress instead of the whole queue.
+    `password` is None for files that are not protected.
+    '''
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY,
+            link TEXT NOT NULL,
+            name TEXT,
+            size TEXT,
+            dl_name TEXT,
+            password TEXT,
+            status TEXT NOT NULL DEFAULT 'Waiting',
+            done INTEGER NOT NULL DEFAULT 0,
+            total INTEGER NOT NULL DEFAULT 0,
+            updated REAL NOT NULL DEFAULT 0)''')
+        self.conn.commit()
+
+    def _write(self, sql, rows):
+        with self.lock:
+            try:
+                self.conn.executemany(sql, rows)
+                self.conn.commit()
+            except sqlite3.Error as e:
+                logging.debug(f'Failed to save download queue: {e}')
+
+    def add_many(self, jobs) -> list:
+        '''
+        Insert (link, name, size, dl_name, password) tuples in one transaction.
+        Returns their ids in the same order.
+        '''
+        now = time.time()
+        ids = []
+        with self.lock:
+            try:
+                for link, name, size, dl_name, password in jobs:
+                    cursor = self.conn.execute(
+                        'INSERT INTO jobs (link, name, size, dl_name, password, updated) '
+                        'VALUES (?, ?, ?, ?, ?, ?)',
+                        (link, name, size, dl_name or None, password, now))
+                    ids.append(cursor.lastrowid)
+                self.conn.commit()
+            except sqlite3.Error as e:
+                logging.debug(f'Failed to save download queue: {e}')
+                self.conn.rollback()
+                ids += [None] * (len(jobs) - len(ids))
+        return ids
+
+    def add(self, link, name=None, size=None, dl_name=None, password=None):
+        return self.add_many([(link, name, size, dl_name, password)])[0]
+
+    def set_password(self, job_id, password):
+        self._write('UPDATE jobs SET password = ?, updated = ? WHERE id = ?',
+                    [(password, time.time(), job_id)])
+
+    def checkpoint(self, rows):
+        '''
+        Save (done, total, status, dl_name, id) of several jobs at once.
+        '''
+        now = time.time()
+        self._write('UPDATE jobs SET done = ?, total = ?, status = ?, '
+                    'dl_name = COALESCE(?, dl_name), updated = ? WHERE id = ?',
+                    [(done, total, status, dl_name, now, job_id)
+                     for done, total, status, dl_name, job_id in rows])
+
+    def remove(self, job_id):
+        self._write('DELETE FROM jobs WHERE id = ?', [(job_id,)])
+
+    def load(self) -> list:
+        '''
+        Every unfinished job as a dict, in the order they were added.
+        '''
+        with self.lock:
+            rows = self.conn.execute(
+                f'SELECT {", ".join(COLUMNS)} FROM jobs ORDER BY id').fetchall()
+        return [dict(zip(COLUMNS, row)) for row in rows]
+
+    def import_pickle(self, path):
+        '''
+        Move the downloads of a pickled app/cache ([link, dl_name, password,
+        progress] lists, written by older versions) into the store.
+        '''
+        try:
+            with open(path, 'rb') as f:
+                cached = pickle.load(f)
+        except FileNotFoundError:
+            return
+        except (EOFError, pickle.UnpicklingError):
+            cached = []
+        self.add_many([(link, dl_name, None, dl_name, password)
+                       for link, dl_name, password, progress in cached])
+        os.remove(path)
+        logging.debug(f'Imported {len(cached)} downloads from {path}.')
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_job_store() -> JobStore:
+    '''
+    Shared JobStore, opened on first use.
+    '''
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = JobStore(job_store_path())
+        return _store
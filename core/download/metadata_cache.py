@@ -0,0 +1,135 @@
+import os
+import re
+import json
+import time
+import atexit
+import logging
+import threading
+from collections import OrderedDict
+
+# Most entries kept (least recently used is dropped first)
+MAX_ENTRIES = 5000
+# Lifetime (seconds) of a file's name/size/password flag
+FILE_TTL = 7 * 24 * 60 * 60
+# Folder contents change more often than file metadata
+FOLDER_TTL = 60 * 60
+# Resolved ouo.io links never change
+ALIAS_TTL = 30 * 24 * 60 * 60
+# Puts are written to disk at most this often (seconds)
+SAVE_INTERVAL = 5
+
+
+def cache_path():
+    '''
+    Path of the metadata cache, next to the other app/ files.
+    '''
+    from .helpers import app_path
+    return app_path('metadata.json')
+
+
+def cache_key(link: str) -> str:
+    '''
+    Canonical id of a link: `file:<id>` and `dir:<id>` are shared by every
+    1fichier mirror domain, anything else is keyed by the link itself.
+    '''
+    link = link.strip()
+    match = re.search(r'/dir/([A-Za-z0-9]+)', link)
+    if match:
+        return f'dir:{match[1]}'
+    match = re.search(r'\?([A-Za-z0-9]+)', link)
+    if match and '/dir/' not in link:
+        return f'file:{match[1].lower()}'
+    match = re.match(r'(?:https?://)?([A-Za-z0-9]+)\.1fichier\.com/?$', link)
+    if match:
+        return f'file:{match[1].lower()}'
+    return f'link:{link}'
+
+
+class MetadataCache:
+    '''
+    LRU of JSON values with a lifetime per entry, saved to disk so
+    links re-added on startup do not fetch their landing page again.
+    '''
+
+    def __init__(self, path, max_entries=MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.dirty = False
+        self.saved = 0
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        # Saved oldest first, so the LRU order survives a restart
+        for key, expires, value in data if isinstance(data, list) else []:
+            if expires > now:
+                self.entries[key] = (expires, value)
+        logging.debug(f'Metadata cache loaded {len(self.entries)} entries.')
+
+    def get(self, link):
+        '''
+        Cached value of `link`, None if missing or expired.
+        '''
+        key = cache_key(link)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self.entries[key]
+                self.dirty = True
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, link, value, ttl=FILE_TTL):
+        key = cache_key(link)
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (time.time() + ttl, value)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self.dirty = True
+            due = time.time() - self.saved > SAVE_INTERVAL
+        if due:
+            self.save()
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            data = [[key, expires, value]
+                    for key, (expires, value) in self.entries.items()]
+            self.dirty = False
+            self.saved = time.time()
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = f'{self.path}.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logging.debug(f'Failed to save metadata cache: {e}')
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_metadata_cache() -> MetadataCache:
+    '''
+    Shared MetadataCache, loaded on first use and saved at exit.
+    '''
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = MetadataCache(cache_path())
+            atexit.register(_cache.save)
+        return _cache
@@ -0,0 +1,295 @@
+import os
+import json
+import time
+import logging
+import threading
+
+# Prefix of every exported metric
+NAMESPACE = 'fichier_dl'
+# Upper bounds (seconds) of the latency histograms
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Seconds between two JSON dumps
+DUMP_INTERVAL = 60
+
+
+def label_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(key) -> str:
+    if not key:
+        return ''
+    return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in key) + '}'
+
+
+class Metric:
+    kind = ''
+
+    def __init__(self, name, help=''):
+        self.name = f'{NAMESPACE}_{name}'
+        self.help = help
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def samples(self) -> list:
+        '''
+        [(suffix, label key, value)] of the current values.
+        '''
+        with self.lock:
+            return [('', key, value) for key, value in self.values.items()]
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        for suffix, key, value in self.samples():
+            lines.append(f'{self.name}{suffix}{format_labels(key)} {value!r}')
+        return '\n'.join(lines)
+
+    def as_dict(self):
+        with self.lock:
+            return [{'labels': dict(key), 'value': value}
+                    for key, value in self.values.items()]
+
+
+class Counter(Metric):
+    '''
+    Value that only goes up, e.g. bytes written.
+    '''
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    '''
+    Current value, set directly or read from `function` when exported.
+    '''
+    kind = 'gauge'
+
+    def __init__(self, name, help=''):
+        super().__init__(name, help)
+        self.function = None
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[label_key(labels)] = value
+
+    def set_function(self, function):
+        self.function = function
+
+    def _read(self):
+        if self.function:
+            try:
+                self.set(self.function())
+            except Exception as e:
+                logging.debug(f'Failed to read gauge {self.name}: {e}')
+
+    def samples(self) -> list:
+        self._read()
+        return super().samples()
+
+    def as_dict(self):
+        self._read()
+        return super().as_dict()
+
+
+class Histogram(Metric):
+    '''
+    Distribution of observed values in cumulative `buckets`.
+    '''
+    kind = 'histogram'
+
+    def __init__(self, name, help='', buckets=LATENCY_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = label_key(labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                # [count per bucket (+Inf last), sum]
+                state = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    break
+            else:
+                i = len(self.buckets)
+            state[0][i] += 1
+            state[1] += value
+
+    def _snapshot(self):
+        with self.lock:
+            return [(key, list(counts), total) for key, (counts, total) in self.values.items()]
+
+    def samples(self) -> list:
+        samples = []
+        for key, counts, total in self._snapshot():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else f'{bound:g}'
+                samples.append(('_bucket', key + (('le', le),), cumulative))
+            samples.append(('_sum', key, total))
+            samples.append(('_count', key, cumulative))
+        return samples
+
+    def as_dict(self):
+        return [{'labels': dict(key), 'count': sum(counts), 'sum': total,
+                 'buckets': dict(zip([f'{b:g}' for b in self.buckets] + ['+Inf'], counts))}
+                for key, counts, total in self._snapshot()]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help='') -> Counter:
+        return self.register(Counter(name, help))
+
+    def gauge(self, name, help='') -> Gauge:
+        return self.register(Gauge(name, help))
+
+    def histogram(self, name, help='', buckets=LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, buckets))
+
+    def render(self) -> str:
+        '''
+        Every metric in the Prometheus text format.
+        '''
+        return '\n'.join(metric.render() for metric in self.metrics) + '\n'
+
+    def as_dict(self) -> dict:
+        return {'time': time.time(),
+                'metrics': {metric.name: {'type': metric.kind, 'values': metric.as_dict()}
+                            for metric in self.metrics}}
+
+
+registry = Registry()
+
+BYTES = registry.counter('bytes_total', 'Bytes of file data received')
+RESOLUTIONS = registry.counter(
+    'resolutions_total', 'Download form attempts by outcome of the proxy')
+JOBS = registry.counter('jobs_total', 'Finished downloads by result')
+RESOLVE_SECONDS = registry.histogram(
+    'resolve_seconds', 'Time to answer the download form through a proxy')
+TTFB_SECONDS = registry.histogram(
+    'ttfb_seconds', 'Time from requesting the direct link to the response headers')
+QUEUE_DEPTH = registry.gauge('queue_depth', 'Downloads waiting for a free slot')
+ACTIVE_JOBS = registry.gauge('active_jobs', 'Downloads running')
+PROXY_QUEUE = registry.gauge('proxy_queue_size', 'Proxies ready to be tried')
+PROXY_COOLING = registry.gauge(
+    'proxy_cooling', 'Proxies waiting out the per-IP download limit')
+
+
+def serve_metrics(port, host='127.0.0.1'):
+    '''
+    Export the metrics on http://host:port/metrics (Prometheus text)
+    and /metrics.json from a background thread.
+    '''
+    # http.server is only loaded when the endpoint is enabled
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = self.path.split('?')[0]
+            if path in ('/', '/metrics'):
+                body = registry.render().encode()
+                content_type = 'text/plain; version=0.0.4; charset=utf-8'
+            elif path == '/metrics.json':
+                body = json.dumps(registry.as_dict()).encode()
+                content_type = 'application/json'
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.info(f'Serving metrics on http://{host}:{server.server_port}/metrics')
+    return server
+
+
+def dump_metrics(path):
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(registry.as_dict(), f)
+        os.replace(tmp, path)
+    except OSError as e:
+        logging.debug(f'Failed to dump metrics: {e}')
+
+
+class MetricsDumper:
+    '''
+    Writes the metrics as JSON to `path` every `interval` seconds.
+    '''
+
+    def __init__(self, path, interval=DUMP_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def _loop(self):
+        while not self.stopped.wait(self.interval):
+            dump_metrics(self.path)
+
+    def stop(self):
+        self.stopped.set()
+        dump_metrics(self.path)
+
+
+_server = None
+_dumper = None
+
+
+def apply_settings(settings):
+    '''
+    Start or stop the exports from app/settings
+    (11: HTTP port, 0 = off, 12: JSON dump file).
+    '''
+    global _server, _dumper
+    port = int(settings[11] or 0) if settings and len(settings) > 11 else 0
+    path = settings[12] if settings and len(settings) > 12 else ''
+    if _server and _server.server_port != port:
+        _server.shutdown()
+        _server.server_close()
+        _server = None
+    if port and not _server:
+        try:
+            _server = serve_metrics(port)
+        except OSError as e:
+            logging.warning(f'Cannot serve metrics on port {port}: {e}')
+    if _dumper and _dumper.path != path:
+        _dumper.stop()
+        _dumper = None
+    if path and not _dumper:
+        _dumper = MetricsDumper(path)
+
+
+def close():
+    '''
+    Write the last JSON dump.
+    '''
+    if _dumper:
+        _dumper.stop()
@@ -0,0 +1,140 @@
+import os
+import sys
+import logging
+import threading
+from collections import Counter
+
+# Seconds between two stack samples of the sampling profiler
+SAMPLE_INTERVAL = 0.005
+PROFILERS = ('cprofile', 'sampling')
+# From 3.12 cProfile uses sys.monitoring: one profile sees every thread
+# and a second one cannot be enabled
+PROFILE_PER_THREAD = sys.version_info < (3, 12)
+
+
+class ThreadProfiler:
+    '''
+    cProfile of the calling thread and of every thread started afterwards
+    (download and proxy threads are started per job), merged on `stop()`
+    and written in the pstats format (snakeviz, `python -m pstats`).
+    Before Python 3.12 each thread gets its own profile.
+    '''
+
+    def __init__(self):
+        self.profiles = []
+        self.lock = threading.Lock()
+
+    def _new_profile(self):
+        import cProfile
+        profile = cProfile.Profile()
+        with self.lock:
+            self.profiles.append(profile)
+        profile.enable()
+
+    def _hook(self, frame, event, arg):
+        # First profile event of a new thread, replaced by cProfile's own hook
+        self._new_profile()
+
+    def start(self):
+        if PROFILE_PER_THREAD:
+            threading.setprofile(self._hook)
+        self._new_profile()
+
+    def stop(self, path):
+        import pstats
+        if PROFILE_PER_THREAD:
+            threading.setprofile(None)
+        with self.lock:
+            profiles = list(self.profiles)
+        stats = None
+        for profile in profiles:
+            profile.disable()
+            try:
+                if stats is None:
+                    stats = pstats.Stats(profile)
+                else:
+                    stats.add(profile)
+            except TypeError:
+                # Thread ended before it ran any profiled code
+                continue
+        if stats:
+            stats.dump_stats(path)
+
+
+class SamplingProfiler:
+    '''
+    Records the stacks of all threads every SAMPLE_INTERVAL seconds and
+    writes them as collapsed stacks (speedscope, flamegraph.pl).
+    Costs almost nothing in the profiled threads.
+    '''
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples = Counter()
+        self.stopped = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._loop, name='sampling-profiler', daemon=True).start()
+
+    def _loop(self):
+        own = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}'
+                                 f':{code.co_firstlineno})')
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def stop(self, path):
+        self.stopped.set()
+        with open(path, 'w') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+_profiler = None
+
+
+def profile_path(kind) -> str:
+    '''
+    Default output of a profiler, next to the other app/ files.
+    '''
+    from .helpers import app_path
+    return app_path('profile.pstats' if kind == 'cprofile' else 'profile.folded')
+
+
+def start_profiler(kind):
+    '''
+    Start the 'cprofile' or 'sampling' profiler, until stop_profiler().
+    '''
+    global _profiler
+    if _profiler or not kind:
+        return
+    if kind not in PROFILERS:
+        logging.warning(f'Unknown profiler: {kind}')
+        return
+    _profiler = ThreadProfiler() if kind == 'cprofile' else SamplingProfiler()
+    _profiler.start()
+    logging.info(f'Started the {kind} profiler.')
+
+
+def stop_profiler(path=None):
+    global _profiler
+    if not _profiler:
+        return
+    profiler, _profiler = _profiler, None
+    if not path:
+        path = profile_path('cprofile' if isinstance(profiler, ThreadProfiler) else 'sampling')
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        profiler.stop(path)
+        logging.info(f'Wrote profile to {path}')
+    except OSError as e:
+        logging.warning(f'Failed to write profile: {e}')
@@ -0,0 +1,162 @@
+import time
+import threading
+from typing import NamedTuple, Optional
+from .helpers import convert_size
+from .metrics import BYTES
+from .speed import SpeedEstimator, format_eta, format_speed
+
+
+class ProgressSnapshot(NamedTuple):
+    '''
+    State of one download as shown in the table.
+    Fields follow the column order, None leaves a column untouched.
+    '''
+    name: Optional[str] = None
+    size: Optional[str] = None
+    status: Optional[str] = None
+    proxy: Optional[str] = None
+    speed: Optional[str] = None
+    progress: Optional[float] = None
+    eta: Optional[str] = None
+
+
+class Progress:
+    '''
+    Progress counters of one download.
+    Workers only assign fields and add byte counts here,
+    formatting happens when the bus takes a snapshot.
+    '''
+
+    def __init__(self, key=None):
+        self.key = key
+        self.name = None
+        self.size = None
+        self.status = None
+        self.proxy = None
+        self.total = 0
+        self.done = 0
+        self.start = None
+        self.speed = SpeedEstimator()
+        self.version = 0
+        # Transfers started and broken off, read by the concurrency controller
+        self.transfers = 0
+        self.failures = 0
+
+    def update(self, status=None, proxy=None, name=None, size=None):
+        if status is not None:
+            self.status = status
+        if proxy is not None:
+            self.proxy = proxy
+        if name is not None:
+            self.name = name
+        if size is not None:
+            self.size = size
+        self.version += 1
+
+    def start_transfer(self, total, done=0):
+        '''
+        Start counting bytes of a `total` bytes file, `done` of them already on disk.
+        '''
+        self.total = total
+        self.done = done
+        self.start = time.time()
+        self.speed.reset()
+        self.speed.sample(done)
+        self.size = convert_size(total)
+        self.transfers += 1
+        self.update(status='Downloading')
+
+    def add(self, n):
+        self.done += n
+        BYTES.inc(n)
+
+    def set_done(self, done):
+        if done > self.done:
+            BYTES.inc(done - self.done)
+        self.done = done
+
+    def stop_transfer(self, status=None):
+        self.start = None
+        self.update(status=status)
+
+    def fail(self):
+        '''
+        The transfer broke off before the file was complete.
+        '''
+        self.failures += 1
+
+    def rate(self) -> float:
+        '''
+        Current bytes per second, sampled on every call while transferring.
+        '''
+        if self.start is None:
+            return 0.0
+        self.speed.sample(self.done)
+        return self.speed.rate()
+
+    def remaining(self) -> int:
+        return max(self.total - self.done, 0) if self.total else 0
+
+    def snapshot(self) -> ProgressSnapshot:
+        rate = self.rate()
+        if self.start is not None and self.total:
+            eta = format_eta(self.speed.eta(self.remaining()))
+        else:
+            eta = ''
+        progress = round(100 * self.done / self.total, 2) if self.total else None
+        return ProgressSnapshot(self.name, self.size, self.status,
+                                self.proxy, format_speed(rate), progress, eta)
+
+
+class ProgressBus:
+    '''
+    Collects the Progress of every active download.
+    A single timer calls `collect()` and receives snapshots of the downloads
+    that changed since the previous call, however many chunks were written.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.trackers = {}
+        self.published = {}
+
+    def track(self, key) -> Progress:
+        progress = Progress(key)
+        with self.lock:
+            self.trackers[id(key)] = progress
+        return progress
+
+    def untrack(self, key):
+        with self.lock:
+            self.trackers.pop(id(key), None)
+            self.published.pop(id(key), None)
+
+    def collect(self):
+        '''
+        Returns [(key, ProgressSnapshot)] of the changed downloads.
+        '''
+        with self.lock:
+            trackers = list(self.trackers.items())
+        changed = []
+        for k, progress in trackers:
+            state = (progress.version, progress.done, progress.start is not None)
+            if self.published.get(k) != state or progress.start is not None:
+                self.published[k] = state
+                changed.append((progress.key, progress.snapshot()))
+        return changed
+
+    def totals(self):
+        '''
+        Returns (bytes per second, seconds left or None) of all transfers.
+        Call after `collect()`, which samples the running downloads.
+        '''
+        with self.lock:
+            trackers = list(self.trackers.values())
+        rate = remaining = 0
+        for progress in trackers:
+            if progress.start is not None:
+                rate += progress.speed.rate()
+                remaining += progress.remaining()
+        if not remaining:
+            return rate, 0
+        return rate, remaining / rate if rate > 0 else None
@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import struct
+import threading
+from urllib.parse import urlsplit
+from .proxy_store import get_proxy_store
+
+# Host the proxies must be able to tunnel to (point it at a local server in tests)
+PROBE_TARGET = ('1fichier.com', 443)
+PROBE_TIMEOUT = 5
+PROBE_CONCURRENCY = 64
+
+_running = threading.Event()
+
+
+def is_validating() -> bool:
+    '''
+    True while a background validation is feeding the proxy queue.
+    '''
+    return _running.is_set()
+
+
+def split_proxy(proxy):
+    '''
+    {'https': 'socks5://1.2.3.4:1080'} -> ('socks5', '1.2.3.4', 1080)
+    '''
+    url = proxy.get('https') if isinstance(proxy, dict) else str(proxy)
+    if '://' not in url:
+        url = f'http://{url}'
+    parts = urlsplit(url)
+    return parts.scheme, parts.hostname, parts.port
+
+
+async def _probe_socks5(host, port, target, timeout):
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection(host, port), timeout)
+    try:
+        # Greeting, no authentication
+        writer.write(b'\x05\x01\x00')
+        await writer.drain()
+        reply = await asyncio.wait_for(reader.readexactly(2), timeout)
+        if reply != b'\x05\x00':
+            return None
+        target_host = target[0].encode()
+        writer.write(b'\x05\x01\x00\x03' + bytes([len(target_host)])
+                     + target_host + struct.pack('>H', target[1]))
+        await writer.drain()
+        reply = await asyncio.wait_for(reader.readexactly(2), timeout)
+        return reply[1] == 0
+    finally:
+        writer.close()
+
+
+async def _probe_http(host, port, target, timeout):
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection(host, port), timeout)
+    try:
+        address = f'{target[0]}:{target[1]}'
+        writer.write(
+            f'CONNECT {address} HTTP/1.1\r\nHost: {address}\r\n\r\n'.encode())
+        await writer.drain()
+        status = await asyncio.wait_for(reader.readline(), timeout)
+        if not status.startswith(b'HTTP/'):
+            return None
+        return status.split()[1:2] == [b'200']
+    finally:
+        writer.close()
+
+
+async def probe_proxy(proxy, target=None, timeout=PROBE_TIMEOUT):
+    '''
+    Find out which protocol `proxy` speaks and whether it tunnels to `target`.
+    The declared protocol is tried first, `target` defaults to PROBE_TARGET.
+    Returns the tagged proxy, or None if nothing answered.
+    '''
+    target = target or PROBE_TARGET
+    scheme, host, port = split_proxy(proxy)
+    if not host or not port:
+        return None
+    probes = [('socks5', _probe_socks5), ('http', _probe_http)]
+    if not scheme.startswith('socks'):
+        probes.reverse()
+    for protocol, probe in probes:
+        try:
+            connect = await probe(host, port, target, timeout)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, IndexError):
+            continue
+        if connect is not None:
+            return {'https': f'{protocol}://{host}:{port}',
+                    'protocol': protocol, 'connect': connect}
+    return None
+
+
+async def validate_proxies(proxies, on_valid, target=None,
+                           concurrency=PROBE_CONCURRENCY, timeout=PROBE_TIMEOUT):
+    '''
+    Probe every proxy of the `proxies` iterable, at most `concurrency` at a time.
+    `on_valid` is called with each tagged proxy able to CONNECT to `target`
+    as soon as it passes; dead ones are recorded in the reputation store
+    in one transaction at the end, off the event loop.
+    Returns the number of valid proxies.
+    '''
+    proxies = iter(proxies)
+    valid = 0
+    dead = []
+
+    async def probe_next():
+        nonlocal valid
+        for proxy in proxies:
+            tagged = await probe_proxy(proxy, target, timeout)
+            if tagged and tagged['connect']:
+                valid += 1
+                on_valid(tagged)
+            else:
+                dead.append(proxy)
+
+    await asyncio.gather(*[probe_next() for _ in range(concurrency)])
+    await asyncio.to_thread(get_proxy_store().record_failures, dead)
+    return valid
+
+
+def start_proxy_validation(fetch, on_valid, target=None,
+                           concurrency=PROBE_CONCURRENCY, timeout=PROBE_TIMEOUT):
+    '''
+    Fetch proxies with `fetch()` and validate them on a background event loop.
+    Only proxies that pass are given to `on_valid` (e.g. ProxyPool.add).
+    '''
+    def run():
+        _running.set()
+        try:
+            proxies = fetch()
+            logging.debug(f'Validating {len(proxies)} proxies.')
+            valid = asyncio.run(validate_proxies(
+                proxies, on_valid, target, concurrency, timeout))
+            logging.debug(f'{valid} of {len(proxies)} proxies passed validation.')
+        except Exception as e:
+            logging.error(f'Proxy validation failed: {e}')
+        finally:
+            _running.clear()
+
+    # Set before the thread starts so callers see it immediately
+    _running.set()
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
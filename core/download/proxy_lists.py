@@ -0,0 +1,184 @@
+import os
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .sessions import get_session
+
+# (connect, read) timeout of a list download, in seconds
+FETCH_TIMEOUT = (5, 15)
+# Lists fetched this recently are used without asking the server
+MAX_AGE = 30 * 60
+# Lists downloaded at once
+FETCH_WORKERS = 8
+# Entries of a list that point to another list
+NESTED_PREFIX = 'https://raw.github'
+
+
+def cache_path():
+    '''
+    Path of the proxy list cache, next to the other app/ files.
+    '''
+    from .helpers import app_path
+    return app_path('proxy_lists.json')
+
+
+class ProxyListCache:
+    '''
+    Last text of every proxy list with its ETag and Last-Modified,
+    saved to disk so a restart can use them before GitHub answers.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if isinstance(data, dict):
+            self.entries = data
+        logging.debug(f'Proxy list cache loaded {len(self.entries)} lists.')
+
+    def get(self, url):
+        with self.lock:
+            return self.entries.get(url)
+
+    def put(self, url, entry):
+        with self.lock:
+            self.entries[url] = entry
+        self.save()
+
+    def save(self):
+        with self.lock:
+            data = json.dumps(self.entries)
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = f'{self.path}.{threading.get_ident()}.tmp'
+            with open(tmp, 'w') as f:
+                f.write(data)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logging.debug(f'Failed to save proxy list cache: {e}')
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_list_cache() -> ProxyListCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ProxyListCache(cache_path())
+        return _cache
+
+
+def fetch_list(url, cache) -> list:
+    '''
+    Lines of the list at `url`, revalidated against the cached copy
+    (If-None-Match / If-Modified-Since). The cached lines are returned
+    when the server cannot be reached.
+    '''
+    import requests
+    entry = cache.get(url)
+    headers = {}
+    if entry and entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    if entry and entry.get('last_modified'):
+        headers['If-Modified-Since'] = entry['last_modified']
+    try:
+        r = get_session().get(url, headers=headers, timeout=FETCH_TIMEOUT)
+    except requests.RequestException as e:
+        logging.debug(f'Failed to get proxy list from {url}: {e}')
+        return entry['lines'] if entry else []
+    if r.status_code == 304 and entry:
+        cache.put(url, dict(entry, fetched=time.time()))
+        return entry['lines']
+    if r.status_code != 200:
+        logging.debug(f'Failed to get proxy list from {url}: HTTP {r.status_code}')
+        return entry['lines'] if entry else []
+    lines = r.text.splitlines()
+    cache.put(url, {'etag': r.headers.get('ETag'),
+                    'last_modified': r.headers.get('Last-Modified'),
+                    'fetched': time.time(), 'lines': lines})
+    return lines
+
+
+def nested_lists(lines) -> list:
+    return sorted({line for line in lines if line.startswith(NESTED_PREFIX)})
+
+
+def fetch_lists(urls, cache) -> dict:
+    '''
+    {url: lines} of `urls` and of the lists they point to,
+    each level downloaded concurrently.
+    '''
+    lists = {}
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as pool:
+        while urls:
+            lists.update(zip(urls, pool.map(lambda url: fetch_list(url, cache), urls)))
+            urls = [url for lines in list(lists.values()) for url in nested_lists(lines)
+                    if url not in lists]
+            urls = list(dict.fromkeys(urls))
+    return lists
+
+
+def cached_lists(urls, cache):
+    '''
+    ({url: lines}, time of the oldest fetch) from the cache alone,
+    (None, 0) if one of the lists was never downloaded.
+    '''
+    lists = {}
+    oldest = time.time()
+    while urls:
+        for url in urls:
+            entry = cache.get(url)
+            if entry is None:
+                return None, 0
+            lists[url] = entry['lines']
+            oldest = min(oldest, entry.get('fetched', 0))
+        urls = list(dict.fromkeys(url for lines in list(lists.values())
+                                  for url in nested_lists(lines) if url not in lists))
+    return lists, oldest
+
+
+_refreshing = threading.Lock()
+
+
+def refresh_lists(urls):
+    '''
+    Revalidate `urls` on a background thread, once at a time.
+    '''
+    if not _refreshing.acquire(blocking=False):
+        return
+
+    def run():
+        try:
+            fetch_lists(urls, get_list_cache())
+            logging.debug('Proxy lists refreshed.')
+        finally:
+            _refreshing.release()
+
+    threading.Thread(target=run, name='proxy-list-refresh', daemon=True).start()
+
+
+def load_lists(urls) -> dict:
+    '''
+    {url: lines} of the proxy lists `urls` and the lists they point to.
+    Cached lists are returned at once, revalidated in the background
+    when older than MAX_AGE; the first run downloads them.
+    '''
+    cache = get_list_cache()
+    lists, fetched = cached_lists(urls, cache)
+    if lists is None:
+        return fetch_lists(urls, cache)
+    if time.time() - fetched > MAX_AGE:
+        refresh_lists(urls)
+    return lists
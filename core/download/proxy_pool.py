@@ -0,0 +1,239 @@
+import time
+import heapq
+import queue
+import logging
+import threading
+from .helpers import get_proxies
+from .proxy_store import ScoredProxyQueue, proxy_key
+
+# A refill starts when fewer proxies than this are ready
+LOW_WATER = 16
+# Seconds between two refills while the pool is low but not empty
+REFILL_INTERVAL = 60
+# Seconds between two refills while the pool is empty
+EMPTY_RETRY = 5
+# Seconds a blocked get() waits before checking the refill again
+GET_POLL = 1
+# Failures in a row after which a returned proxy is dropped
+MAX_STRIKES = 3
+# Seconds a proxy rests when the site refused it without saying how long
+DEFAULT_COOLDOWN = 60
+
+# Outcomes of a lease
+SUCCESS = 'success'
+FAILURE = 'failure'
+COOLDOWN = 'cooldown'
+
+# Order in which returned proxies are handed out again
+PREFERRED, NORMAL = range(2)
+
+
+class ProxyPool(ScoredProxyQueue):
+    '''
+    The proxies shared by every download, best scored first.
+    Taking one while fewer than `low_water` are left starts a refill
+    (list download and validation) on a background thread; requests
+    made while a refill runs are merged into it. Nothing here blocks
+    except get() itself waiting for a proxy.
+
+    Downloads borrow proxies with lease() and hand them back with
+    release(): a proxy that worked is handed out before any other,
+    one that keeps failing is dropped after MAX_STRIKES. A proxy under
+    1fichier's per-IP wait is held in a heap ordered by the end of its
+    cooldown and comes back once it is over.
+    '''
+
+    def __init__(self, low_water=LOW_WATER, store=None, probe_target=None):
+        super().__init__(store)
+        self.low_water = low_water
+        # (host, port) validated proxies must tunnel to, None = PROBE_TARGET
+        self.probe_target = probe_target
+        self.proxy_settings = None
+        self.refill_lock = threading.Lock()
+        self.last_refill = 0
+        self.lease_lock = threading.Lock()
+        # id(proxy) -> (owner, proxy) of the proxies lent out
+        self.leases = {}
+        # id(proxy) -> tier of a proxy being put back
+        self.tiers = {}
+        # proxy_key -> failures in a row
+        self.strikes = {}
+        # [(end of cooldown, counter, proxy)] and proxy_key -> end of cooldown
+        self.cooling = []
+        self.cooldowns = {}
+        self.cooling_counter = 0
+        # proxy_key of every validated proxy queued, leased or cooling
+        self.members = set()
+
+    def _priority(self, item):
+        return self.tiers.pop(id(item), NORMAL), super()._priority(item)
+
+    def put(self, item, block=True, timeout=None):
+        '''
+        Add a proxy, held back while its address is cooling down.
+        '''
+        with self.lease_lock:
+            until = self.cooldowns.get(proxy_key(item), 0)
+            if until > time.time():
+                self.cooling_counter += 1
+                heapq.heappush(self.cooling, (until, self.cooling_counter, item))
+                return
+        super().put(item, block, timeout)
+
+    def add(self, proxy):
+        '''
+        Add a freshly validated proxy unless its address is already
+        queued, leased or cooling down.
+        '''
+        key = proxy_key(proxy)
+        with self.lease_lock:
+            if key in self.members:
+                return
+            self.members.add(key)
+        self.put(proxy)
+
+    def thaw(self):
+        '''
+        Make the proxies whose cooldown is over available again.
+        '''
+        now = time.time()
+        ready = []
+        with self.lease_lock:
+            while self.cooling and self.cooling[0][0] <= now:
+                until, _, proxy = heapq.heappop(self.cooling)
+                key = proxy_key(proxy)
+                if self.cooldowns.get(key) == until:
+                    del self.cooldowns[key]
+                ready.append(proxy)
+        for proxy in ready:
+            self.put(proxy)
+
+    def cooling_count(self) -> int:
+        return len(self.cooling)
+
+    def refill(self, proxy_settings=None, force=False):
+        '''
+        Start a background refill if the pool is low and none is running.
+        `proxy_settings` is the custom proxy list URL (None = built-in lists).
+        Returns True if a refill was started.
+        '''
+        # asyncio is only loaded once proxies are needed
+        from .proxy_check import is_validating, start_proxy_validation
+        if proxy_settings is not None:
+            self.proxy_settings = proxy_settings
+        size = self.qsize()
+        if not force and size >= self.low_water:
+            return False
+        with self.refill_lock:
+            if is_validating():
+                return False
+            wait = EMPTY_RETRY if size == 0 else REFILL_INTERVAL
+            if not force and time.time() - self.last_refill < wait:
+                return False
+            self.last_refill = time.time()
+            settings = self.proxy_settings
+            logging.debug(f'Refilling the proxy pool ({size} left).')
+            start_proxy_validation(lambda: get_proxies(settings=settings), self.add,
+                                   self.probe_target)
+        return True
+
+    def get(self, block=True, timeout=None):
+        '''
+        Best proxy, refilling the pool when it runs low.
+        Unlike lease() it leaves the pool for good.
+        '''
+        proxy = self._next(block, timeout)
+        with self.lease_lock:
+            self.members.discard(proxy_key(proxy))
+        return proxy
+
+    def _next(self, block, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            self.thaw()
+            self.refill()
+            wait = GET_POLL
+            if deadline is not None:
+                wait = min(wait, max(deadline - time.monotonic(), 0))
+            try:
+                return super().get(block, wait)
+            except queue.Empty:
+                if not block or (deadline is not None and time.monotonic() >= deadline):
+                    raise
+
+    def lease(self, owner=None, block=True, timeout=None):
+        '''
+        Borrow the best proxy for `owner` (a download job) until release().
+        Returns None once `owner` is stopped or paused while waiting.
+        '''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if getattr(owner, 'stopped', False) or getattr(owner, 'paused', False):
+                return None
+            wait = GET_POLL
+            if deadline is not None:
+                wait = min(wait, max(deadline - time.monotonic(), 0))
+            try:
+                proxy = self._next(block, wait)
+                break
+            except queue.Empty:
+                if not block or (deadline is not None and time.monotonic() >= deadline):
+                    raise
+        with self.lease_lock:
+            self.leases[id(proxy)] = (owner, proxy)
+        return proxy
+
+    def lease_many(self, owner, count):
+        '''
+        Up to `count` proxies for `owner`, only the first one is waited for.
+        Empty once `owner` is stopped or paused while waiting.
+        '''
+        proxy = self.lease(owner)
+        proxies = [proxy] if proxy is not None else []
+        while proxies and len(proxies) < count:
+            try:
+                proxy = self.lease(owner, block=False)
+            except queue.Empty:
+                break
+            if proxy is None:
+                break
+            proxies.append(proxy)
+        return proxies
+
+    def release(self, proxy, outcome=None, wait=None):
+        '''
+        Give back a leased proxy. `outcome` is SUCCESS, FAILURE, COOLDOWN
+        (alive but refused for `wait` seconds, DEFAULT_COOLDOWN if unknown)
+        or None when it was not really tried.
+        Releasing a proxy twice does nothing.
+        '''
+        with self.lease_lock:
+            if self.leases.pop(id(proxy), None) is None:
+                return
+            key = proxy_key(proxy)
+            if outcome == FAILURE:
+                strikes = self.strikes[key] = self.strikes.get(key, 0) + 1
+                if strikes >= MAX_STRIKES:
+                    del self.strikes[key]
+                    self.members.discard(key)
+                    logging.debug(f'Dropped proxy {key} after {strikes} failures.')
+                    return
+            elif outcome == SUCCESS:
+                self.strikes.pop(key, None)
+                self.tiers[id(proxy)] = PREFERRED
+            elif outcome == COOLDOWN:
+                self.cooldowns[key] = max(self.cooldowns.get(key, 0),
+                                          time.time() + (wait or DEFAULT_COOLDOWN))
+        self.put(proxy)
+
+    def release_all(self, owner):
+        '''
+        Give back every proxy still leased by `owner`, untried.
+        '''
+        with self.lease_lock:
+            proxies = [proxy for holder, proxy in self.leases.values() if holder is owner]
+        for proxy in proxies:
+            self.release(proxy)
+
+
+proxy_pool = ProxyPool()
@@ -0,0 +1,195 @@
+import os
+import math
+import time
+import queue
+import heapq
+import logging
+import sqlite3
+import threading
+
+# Age after which recorded successes/failures count half as much
+HALF_LIFE = 24 * 60 * 60
+# Resolution latency (seconds) that halves a proxy's score
+LATENCY_SCALE = 10.0
+# Transfer throughput (B/s) that doubles a proxy's score
+THROUGHPUT_SCALE = 1024 * 1024
+# Weight of the newest sample in the latency/throughput averages
+EWMA_ALPHA = 0.3
+
+
+def store_path():
+    '''
+    Path of the reputation database, next to the other app/ files.
+    '''
+    from .helpers import app_path
+    return app_path('proxies.db')
+
+
+def proxy_key(proxy) -> str:
+    '''
+    Return the `protocol://ip:port` string identifying a proxy entry.
+    '''
+    if isinstance(proxy, dict):
+        return str(proxy.get('https'))
+    return str(proxy)
+
+
+class ProxyStore:
+    '''
+    Persistent per-proxy reputation (SQLite).
+    Rows are mirrored in memory so scoring never touches the disk.
+    '''
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS proxies (
+            proxy TEXT PRIMARY KEY,
+            successes REAL NOT NULL DEFAULT 0,
+            failures REAL NOT NULL DEFAULT 0,
+            latency REAL,
+            throughput REAL,
+            last_seen REAL NOT NULL DEFAULT 0)''')
+        self.conn.commit()
+        self.rows = {}
+        for row in self.conn.execute(
+                'SELECT proxy, successes, failures, latency, throughput, last_seen FROM proxies'):
+            self.rows[row[0]] = list(row[1:])
+        logging.debug(f'Proxy store loaded {len(self.rows)} proxies.')
+
+    def _decayed(self, row, now):
+        successes, failures, latency, throughput, last_seen = row
+        decay = math.pow(0.5, max(now - last_seen, 0) / HALF_LIFE)
+        return successes * decay, failures * decay, latency, throughput
+
+    def score(self, proxy, now=None) -> float:
+        '''
+        Higher is better. Unknown proxies score below proven ones
+        and above proxies that keep failing.
+        '''
+        row = self.rows.get(proxy_key(proxy))
+        if row is None:
+            return 0.5 / (1 + 1)
+        successes, failures, latency, throughput = self._decayed(
+            row, now or time.time())
+        reliability = (successes + 1) / (successes + failures + 2)
+        latency = LATENCY_SCALE if latency is None else latency
+        score = reliability / (1 + latency / LATENCY_SCALE)
+        if throughput:
+            score *= 1 + min(throughput / THROUGHPUT_SCALE, 1)
+        return score
+
+    def _merge(self, key, now, success=0, failure=0, latency=None, throughput=None):
+        '''
+        Apply one observation to the in-memory row of `key` (self.lock held).
+        Returns the new row.
+        '''
+        row = self.rows.get(key)
+        if row is None:
+            row = [0, 0, None, None, now]
+        successes, failures, old_latency, old_throughput = self._decayed(
+            row, now)
+        if latency is not None:
+            latency = latency if old_latency is None else (
+                EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * old_latency)
+        else:
+            latency = old_latency
+        if throughput is not None:
+            throughput = throughput if old_throughput is None else (
+                EWMA_ALPHA * throughput + (1 - EWMA_ALPHA) * old_throughput)
+        else:
+            throughput = old_throughput
+        row = [successes + success, failures + failure,
+               latency, throughput, now]
+        self.rows[key] = row
+        return row
+
+    def _save(self, rows):
+        '''
+        Write [key, *row] lists in one transaction (self.lock held).
+        '''
+        try:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO proxies VALUES (?, ?, ?, ?, ?, ?)', rows)
+            self.conn.commit()
+        except sqlite3.Error as e:
+            logging.debug(f'Failed to save proxy reputation: {e}')
+
+    def _update(self, proxy, **observation):
+        key = proxy_key(proxy)
+        with self.lock:
+            row = self._merge(key, time.time(), **observation)
+            self._save([[key] + row])
+
+    def record_success(self, proxy, latency):
+        '''
+        The proxy answered the resolution request in `latency` seconds.
+        '''
+        self._update(proxy, success=1, latency=latency)
+
+    def record_failure(self, proxy):
+        self._update(proxy, failure=1)
+
+    def record_failures(self, proxies):
+        '''
+        One failure for each of `proxies`, saved in a single transaction.
+        '''
+        now = time.time()
+        with self.lock:
+            rows = [[key] + self._merge(key, now, failure=1)
+                    for key in map(proxy_key, proxies)]
+            if rows:
+                self._save(rows)
+
+    def record_throughput(self, proxy, bytes_per_second):
+        self._update(proxy, throughput=bytes_per_second)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_proxy_store() -> ProxyStore:
+    '''
+    Shared ProxyStore, opened on first use.
+    '''
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ProxyStore(store_path())
+        return _store
+
+
+class ScoredProxyQueue(queue.Queue):
+    '''
+    Queue handing out the best scored proxy first instead of FIFO order.
+    Scores are taken when a proxy is put, so a proxy returned after
+    a download goes back in at its new position.
+    '''
+
+    def __init__(self, store=None, maxsize=0):
+        self.store = store
+        self.counter = 0
+        super().__init__(maxsize)
+
+    def _init(self, maxsize):
+        self.queue = []
+
+    def _qsize(self):
+        return len(self.queue)
+
+    def _priority(self, item):
+        '''
+        Heap key of `item`, lowest is handed out first.
+        '''
+        store = self.store or get_proxy_store()
+        return -store.score(item)
+
+    def _put(self, item):
+        self.counter += 1
+        heapq.heappush(self.queue, (self._priority(item), self.counter, item))
+
+    def _get(self):
+        return heapq.heappop(self.queue)[2]
@@ -1,9 +1,9 @@
 import importlib
 import os
 import re
-from curl_cffi import requests
-from bs4 import BeautifulSoup
+import threading
 from urllib.parse import urlparse
+from .tracing import traced
 
 # ouo url
 # Examples:
@@ -41,21 +41,37 @@ def RecaptchaV3():
 # -------------------------------------------
 
 
-client = requests.Session()
-client.headers.update({
-    'authority': 'ouo.io',
-    'accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
-    'accept-language': 'en-GB,en-US;q=0.9,en;q=0.8',
-    'cache-control': 'max-age=0',
-    'referer': 'http://www.google.com/ig/adde?moduleurl=',
-    'upgrade-insecure-requests': '1',
-})
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    '''
+    curl_cffi session for ouo.io, created with the first ouo link.
+    '''
+    global _client
+    with _client_lock:
+        if _client is None:
+            from curl_cffi import requests
+            _client = requests.Session()
+            _client.headers.update({
+                'authority': 'ouo.io',
+                'accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
+                'accept-language': 'en-GB,en-US;q=0.9,en;q=0.8',
+                'cache-control': 'max-age=0',
+                'referer': 'http://www.google.com/ig/adde?moduleurl=',
+                'upgrade-insecure-requests': '1',
+            })
+        return _client
 
 # -------------------------------------------
 # OUO BYPASS
 
 
+@traced('ouo_bypass', 'resolve')
 def ouo_bypass(url):
+    from bs4 import BeautifulSoup
+    client = get_client()
     tempurl = url.replace("ouo.press", "ouo.io")
     p = urlparse(tempurl)
     id = tempurl.split('/')[-1]
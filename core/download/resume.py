@@ -0,0 +1,168 @@
+import os
+import re
+import json
+import hashlib
+import logging
+
+# Bytes before the resume point downloaded again and compared with the file
+TAIL_BLOCK = 64 * 1024
+
+
+class ResumeError(ValueError):
+    '''
+    The server's answer does not continue the partial file.
+    '''
+
+
+def parse_content_range(value):
+    '''
+    `bytes start-end/total` -> (start, end, total), total is None for `*`.
+    '''
+    match = re.match(r'\s*bytes\s+(\d+)-(\d+)/(\d+|\*)', value or '')
+    if not match:
+        return None
+    total = None if match[3] == '*' else int(match[3])
+    return int(match[1]), int(match[2]), total
+
+
+def check_content_range(r, start, total=None) -> int:
+    '''
+    Make sure `r` is the 206 answer to a range request starting at `start`
+    (of a `total` bytes file when known). Returns the file size.
+    '''
+    if r.status_code != 206:
+        raise ResumeError(f'Range request answered with {r.status_code}')
+    content_range = parse_content_range(r.headers.get('Content-Range'))
+    if not content_range:
+        raise ResumeError(
+            f'Invalid Content-Range: {r.headers.get("Content-Range")}')
+    if content_range[0] != start:
+        raise ResumeError(
+            f'Asked for byte {start}, server sent {content_range[0]}')
+    if total and content_range[2] and content_range[2] != total:
+        raise ResumeError(
+            f'File size changed from {total} to {content_range[2]}')
+    return content_range[2] or content_range[1] + 1
+
+
+def tail_hash(path, offset, length):
+    '''
+    sha256 of bytes [offset - length, offset) of `path`.
+    '''
+    with open(path, 'rb') as f:
+        f.seek(offset - length)
+        data = f.read(length)
+    if len(data) != length:
+        return None
+    return hashlib.sha256(data).hexdigest()
+
+
+class ResumeIndex:
+    '''
+    Sidecar `<name>.resume` of a single connection download:
+    the expected size, how many bytes are known to be on disk and
+    the checksum of the block before that point.
+    '''
+
+    def __init__(self, path, total=0, verified=0, tail=None):
+        self.path = path
+        self.total = total
+        self.verified = verified
+        self.tail = tail
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(f'{path}.resume', 'r') as f:
+                data = json.load(f)
+            return cls(path, data['total'], data['verified'], data.get('tail'))
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def save(self):
+        with open(f'{self.path}.resume', 'w') as f:
+            json.dump({'total': self.total, 'verified': self.verified,
+                       'tail': self.tail}, f)
+
+    def checkpoint(self, f, verified, tail_block=TAIL_BLOCK):
+        '''
+        Record that the first `verified` bytes written to file `f` are on disk.
+        '''
+        f.flush()
+        os.fsync(f.fileno())
+        self.verified = verified
+        self.tail = None
+        if tail_block:
+            length = min(tail_block, verified)
+            self.tail = tail_hash(self.path, verified, length) if length else None
+        self.save()
+
+    def remove(self):
+        try:
+            os.remove(f'{self.path}.resume')
+        except FileNotFoundError:
+            pass
+
+
+def resume_point(path, tail_block=TAIL_BLOCK):
+    '''
+    Where to resume `path`: returns (offset, total, tail) where `tail` is the
+    sha256 of the `tail_block` bytes before `offset` (None when not checked).
+    Without an index the whole file is trusted as before, an index whose
+    checksum no longer matches the file restarts the download.
+    '''
+    try:
+        size = os.path.getsize(path)
+    except FileNotFoundError:
+        return 0, None, None
+    index = ResumeIndex.load(path)
+    offset = size
+    if index and index.verified <= size:
+        offset = index.verified
+    length = min(tail_block, offset)
+    if not length:
+        return offset, index.total if index else None, None
+    tail = tail_hash(path, offset, length)
+    if index and index.tail and index.verified == offset and index.tail != tail:
+        logging.debug(f'Checksum of {path} does not match its resume index.')
+        return 0, None, None
+    return offset, index.total if index else None, tail
+
+
+class TailCheck:
+    '''
+    Consumes the first `length` bytes of a resumed body and compares
+    their checksum with `expected`, raising ResumeError on mismatch.
+    '''
+
+    def __init__(self, length, expected):
+        self.length = length
+        self.expected = expected
+        self.hash = hashlib.sha256()
+        self.seen = 0
+
+    def done(self) -> bool:
+        return self.seen >= self.length
+
+    def feed(self, chunk):
+        '''
+        Returns the part of `chunk` that follows the checked block.
+        '''
+        if self.done():
+            return chunk
+        take = self.length - self.seen
+        self.hash.update(chunk[:take])
+        self.seen += len(chunk[:take])
+        if self.done() and self.hash.hexdigest() != self.expected:
+            raise ResumeError('Resumed data does not match the partial file')
+        return chunk[take:]
+
+    def verify(self, chunks):
+        '''
+        Read just the checked block from `chunks`.
+        '''
+        for chunk in chunks:
+            self.feed(chunk)
+            if self.done():
+                return
+        raise ResumeError('Connection closed before the resume point')
@@ -0,0 +1,207 @@
+import time
+import random
+import logging
+import threading
+
+# Delay (seconds) before the first retry, doubled after each failure in a row
+BASE_DELAY = 0.5
+# Longest delay between two attempts of a job
+MAX_DELAY = 30
+# Attempts to get the direct link per job (0 = no limit)
+RESOLVE_ATTEMPTS = 300
+# Broken transfers per job (0 = no limit)
+TRANSFER_ATTEMPTS = 10
+# Upstream failures in a row that pause every job (0 = never)
+BREAKER_THRESHOLD = 5
+# Seconds the jobs stay paused once the breaker opens
+BREAKER_COOLDOWN = 60
+# Seconds between two status updates while waiting
+WAIT_STEP = 0.5
+
+RESOLVE = 'resolution'
+TRANSFER = 'transfer'
+
+
+class RetryError(Exception):
+    '''
+    A job used up one of its retry budgets, the message is its status.
+    '''
+
+
+class RetryPolicy:
+    '''
+    Backoff and budgets shared by every job.
+    '''
+
+    def __init__(self, base_delay=BASE_DELAY, max_delay=MAX_DELAY,
+                 resolve_attempts=RESOLVE_ATTEMPTS, transfer_attempts=TRANSFER_ATTEMPTS):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.limits = {RESOLVE: resolve_attempts, TRANSFER: transfer_attempts}
+
+    def delay(self, streak) -> float:
+        '''
+        Exponential backoff with full jitter after `streak` failures in a row.
+        '''
+        if streak <= 0:
+            return 0.0
+        ceiling = min(self.max_delay, self.base_delay * 2 ** (streak - 1))
+        return random.uniform(0, ceiling)
+
+    def budget(self) -> 'RetryBudget':
+        return RetryBudget(self)
+
+
+class RetryBudget:
+    '''
+    Failures of one download, counted apart for the resolution of the
+    direct link (mostly proxies) and for the transfer itself.
+    '''
+
+    def __init__(self, policy):
+        self.policy = policy
+        self.failures = {RESOLVE: 0, TRANSFER: 0}
+        # Failures in a row of each kind, the backoff grows with them
+        self.streaks = {RESOLVE: 0, TRANSFER: 0}
+        # Kind of the last failure
+        self.kind = RESOLVE
+
+    def fail(self, kind, attempts=1) -> float:
+        '''
+        Count failed attempts of `kind`, returns the delay before the next one.
+        Raises RetryError once the budget of `kind` is used up.
+        '''
+        self.failures[kind] += attempts
+        self.streaks[kind] += 1
+        self.kind = kind
+        limit = self.policy.limits[kind]
+        if limit and self.failures[kind] >= limit:
+            raise RetryError(f'Failed: {self.failures[kind]} {kind} attempts')
+        return self.policy.delay(self.streaks[kind])
+
+    def succeed(self, kind):
+        '''
+        An attempt of `kind` worked, its backoff starts over.
+        '''
+        self.streaks[kind] = 0
+
+    def status(self, delay) -> str:
+        limit = self.policy.limits[self.kind]
+        return f'Retry in {delay:.0f}s ({self.kind} {self.failures[self.kind]}/{limit or "∞"})'
+
+
+class CircuitBreaker:
+    '''
+    Shared by every job: after `threshold` failures of 1fichier itself in
+    a row (5xx answers, direct links failing through a working proxy)
+    all jobs hold off for `cooldown` seconds. The next failure after that
+    opens it again at once, the next success closes it.
+    '''
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.open_until = 0
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            now = time.time()
+            if self.threshold and self.failures >= self.threshold and now >= self.open_until:
+                self.open_until = now + self.cooldown
+                logging.warning(f'1fichier failed {self.failures} times in a row, '
+                                f'pausing downloads for {self.cooldown}s.')
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.open_until = 0
+
+    def remaining(self) -> float:
+        '''
+        Seconds until jobs may try again, 0 while closed.
+        '''
+        return max(self.open_until - time.time(), 0.0)
+
+
+policy = RetryPolicy()
+breaker = CircuitBreaker()
+
+
+def transfer_failed(budget, received) -> float:
+    '''
+    Count a broken transfer, returns the delay before the next attempt.
+    One that still `received` data proves 1fichier works: the breaker
+    closes and the transfer backoff starts over.
+    '''
+    if received:
+        budget.succeed(TRANSFER)
+        breaker.record_success()
+    return budget.fail(TRANSFER)
+
+
+def _next_wait(job, end, budget):
+    '''
+    Seconds `job` should wait before looking again (its status says why),
+    0 once it may go on, None if it was stopped or paused.
+    '''
+    if job.stopped or job.paused:
+        return None
+    paused = breaker.remaining()
+    left = end - time.time()
+    if paused > 0:
+        job.progress.update(status=f'Paused: 1fichier failing, retry in {paused:.0f}s')
+    elif left > 0 and budget:
+        job.progress.update(status=budget.status(left))
+    if paused <= 0 and left <= 0:
+        return 0
+    return min(WAIT_STEP, max(paused, left))
+
+
+def wait_retry(worker, delay=0.0, budget=None) -> bool:
+    '''
+    Hold `worker` while the breaker is open, then for `delay` seconds.
+    False if it was stopped or paused meanwhile.
+    '''
+    end = time.time() + delay
+    while True:
+        step = _next_wait(worker, end, budget)
+        if step is None:
+            return False
+        if not step:
+            return True
+        time.sleep(step)
+
+
+async def wait_retry_async(job, delay=0.0, budget=None) -> bool:
+    '''
+    wait_retry() for the asyncio engine.
+    '''
+    import asyncio
+    end = time.time() + delay
+    while True:
+        step = _next_wait(job, end, budget)
+        if step is None:
+            return False
+        if not step:
+            return True
+        await asyncio.sleep(step)
+
+
+def apply_settings(settings):
+    '''
+    Configure the policy and the breaker from app/settings
+    (15: resolution attempts, 16: transfer attempts, 0 = no limit,
+    17: longest backoff in seconds, 18: breaker threshold, 0 = off).
+    '''
+    def setting(index, default):
+        if settings and len(settings) > index and settings[index] is not None:
+            return settings[index]
+        return default
+
+    policy.limits[RESOLVE] = int(setting(15, RESOLVE_ATTEMPTS))
+    policy.limits[TRANSFER] = int(setting(16, TRANSFER_ATTEMPTS))
+    policy.max_delay = max(float(setting(17, MAX_DELAY)), policy.base_delay)
+    breaker.threshold = int(setting(18, BREAKER_THRESHOLD))
@@ -0,0 +1,225 @@
+import os
+import json
+import time
+import logging
+import threading
+from .bandwidth import bandwidth
+from .resume import check_content_range
+from .retry import policy, wait_retry
+from .sessions import get_session
+
+# Segments smaller than this are not split any further
+MIN_SPLIT = 1024 * 1024
+# A segment without progress for this long may be taken over entirely
+STALL_TIMEOUT = 15
+# How often the segment map is written to disk while downloading
+SAVE_INTERVAL = 2
+
+
+class Segment:
+    '''
+    Byte range [start, end) of the file, `pos` is the next byte to write.
+    '''
+
+    def __init__(self, start, end, pos=None):
+        self.start = start
+        self.end = end
+        self.pos = start if pos is None else pos
+        self.owner = None
+        self.last_progress = time.time()
+
+    def remaining(self) -> int:
+        return max(self.end - self.pos, 0)
+
+
+class SegmentMap:
+    '''
+    Segments of one `.unfinished` file, saved next to it as `<name>.segments`
+    so a paused download resumes every segment where it stopped.
+    '''
+
+    def __init__(self, path, total, segments):
+        self.path = path
+        self.total = total
+        self.segments = segments
+        self.lock = threading.Lock()
+        self.saved = 0
+
+    @classmethod
+    def plan(cls, path, total, count, done=0):
+        '''
+        Split `total` bytes in `count` ranges. The first `done` bytes
+        (an earlier single stream download) are kept as they are.
+        '''
+        segments = [Segment(0, done, done)] if done else []
+        size = max((total - done) // count, 1)
+        start = done
+        while start < total:
+            end = total if total - start < 2 * size else start + size
+            segments.append(Segment(start, end))
+            start = end
+        return cls(path, total, segments)
+
+    @classmethod
+    def load(cls, path):
+        '''
+        Return the saved map of `path`, or None if there is none.
+        '''
+        try:
+            with open(f'{path}.segments', 'r') as f:
+                data = json.load(f)
+            segments = [Segment(*s) for s in data['segments']]
+            return cls(path, data['total'], segments)
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def save(self):
+        '''
+        Write the map once the bytes it counts as written are on disk.
+        Fetchers flush every chunk before moving `pos`, so syncing the
+        file after taking the positions covers all of them.
+        '''
+        with self.lock:
+            data = {'total': self.total,
+                    'segments': [[s.start, s.end, s.pos] for s in self.segments]}
+        with open(self.path, 'ab') as f:
+            os.fsync(f.fileno())
+        tmp = f'{self.path}.segments.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp, f'{self.path}.segments')
+        self.saved = time.time()
+
+    def remove(self):
+        for name in (f'{self.path}.segments', f'{self.path}.segments.tmp'):
+            try:
+                os.remove(name)
+            except FileNotFoundError:
+                pass
+
+    def done_bytes(self) -> int:
+        return self.total - sum(s.remaining() for s in self.segments)
+
+    def complete(self) -> bool:
+        return all(s.remaining() == 0 for s in self.segments)
+
+    def claim(self, owner):
+        '''
+        Give `owner` an unowned segment, or steal work from the busiest one.
+        The stolen half of a segment becomes a new segment.
+        '''
+        with self.lock:
+            for s in self.segments:
+                if s.owner is None and s.remaining():
+                    s.owner = owner
+                    s.last_progress = time.time()
+                    return s
+
+            busy = [s for s in self.segments if s.remaining()]
+            if not busy:
+                return None
+            victim = max(busy, key=lambda s: s.remaining())
+            if time.time() - victim.last_progress > STALL_TIMEOUT:
+                # Stalled, take everything that is left
+                split = victim.pos
+            elif victim.remaining() >= 2 * MIN_SPLIT:
+                split = victim.pos + victim.remaining() // 2
+            else:
+                return None
+            stolen = Segment(split, victim.end)
+            stolen.owner = owner
+            victim.end = split
+            self.segments.append(stolen)
+            logging.debug(
+                f'Segment {split}-{stolen.end} taken over by fetcher {owner}.')
+            return stolen
+
+
+def preallocate(path, total):
+    '''
+    Create `path` with its final size so segments can be written in place.
+    '''
+    mode = 'r+b' if os.path.exists(path) else 'wb'
+    with open(path, mode) as f:
+        f.truncate(total)
+
+
+def fetch_segments(worker, url, headers, proxies, segment_map, count, on_progress=None):
+    '''
+    Download the remaining segments of `segment_map` with `count` parallel
+    connections. Fetcher n goes through `proxies[n % len(proxies)]`, 1fichier
+    direct links are bound to the requesting IP so usually only one is given.
+    `on_progress(done_bytes)` is called from this thread about twice a second.
+    A fetcher whose segment failed backs off like the job's retries.
+    Returns True once every segment is complete.
+    '''
+    errors = []
+
+    def fetcher(n):
+        p = proxies[n % len(proxies)]
+        # Failures in a row of this fetcher
+        streak = 0
+        with open(segment_map.path, 'r+b') as f:
+            while not (worker.stopped or worker.paused):
+                segment = segment_map.claim(n)
+                if segment is None:
+                    return
+                try:
+                    fetch_segment(worker, url, headers, p, segment, f,
+                                  segment_map.total)
+                    streak = 0
+                except Exception as e:
+                    logging.debug(f'Segment fetch failed: {e}')
+                    errors.append(e)
+                    if len(errors) > 4 * count:
+                        return
+                    streak += 1
+                finally:
+                    segment.owner = None
+                # The segment is free meanwhile, other fetchers may take it
+                if streak and not wait_retry(worker, policy.delay(streak)):
+                    return
+
+    threads = [threading.Thread(target=fetcher, args=(n,), daemon=True)
+               for n in range(count)]
+    for thread in threads:
+        thread.start()
+    while any(thread.is_alive() for thread in threads):
+        for thread in threads:
+            thread.join(0.5)
+        if on_progress:
+            on_progress(segment_map.done_bytes())
+        if time.time() - segment_map.saved > SAVE_INTERVAL:
+            segment_map.save()
+
+    if segment_map.complete():
+        segment_map.remove()
+        return True
+    segment_map.save()
+    return False
+
+
+def fetch_segment(worker, url, headers, proxies, segment, f, total=None):
+    '''
+    Stream one segment into file `f`, stopping early when its end
+    has been moved by a fetcher that stole part of it.
+    Nothing is written unless the answer covers the requested range
+    of a `total` bytes file.
+    '''
+    headers = dict(headers)
+    headers['Range'] = f'bytes={segment.pos}-{segment.end - 1}'
+    with get_session(proxies).get(url, stream=True, headers=headers, proxies=proxies,
+                                  timeout=worker.timeout, verify=False) as r:
+        check_content_range(r, segment.pos, total)
+        f.seek(segment.pos)
+        for chunk in r.iter_content(64 * 1024):
+            if worker.stopped or worker.paused:
+                return
+            chunk = chunk[:segment.end - segment.pos]
+            bandwidth.acquire(len(chunk), worker.priority, worker)
+            f.write(chunk)
+            f.flush()
+            segment.pos += len(chunk)
+            segment.last_progress = time.time()
+            if segment.pos >= segment.end:
+                return
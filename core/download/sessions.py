@@ -0,0 +1,127 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+from .proxy_store import proxy_key
+
+# Most sessions kept open at once (least recently used is evicted first)
+MAX_SESSIONS = 64
+# Sessions unused for this long (seconds) are evicted
+IDLE_TIMEOUT = 120
+# Connections kept alive per host inside one session
+POOL_MAXSIZE = 16
+
+
+class SessionPool:
+    '''
+    One keep-alive requests.Session per proxy, so the resolution POST,
+    the password re-POST and the direct link GET through the same proxy
+    reuse one connection instead of paying TCP, TLS and CONNECT again.
+    '''
+
+    def __init__(self, max_sessions=MAX_SESSIONS, idle_timeout=IDLE_TIMEOUT,
+                 pool_maxsize=POOL_MAXSIZE):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.pool_maxsize = pool_maxsize
+        self.lock = threading.Lock()
+        self.sessions = OrderedDict()
+        # Evicted sessions a response is still streaming through
+        self.retired = []
+
+    def _new_session(self, proxies):
+        # requests is imported with the first session instead of at startup
+        import requests
+        import urllib3
+        from requests.adapters import HTTPAdapter
+        # SSL Ignore warning
+        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_maxsize)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        if proxies:
+            session.proxies.update(
+                {k: v for k, v in proxies.items() if k in ('http', 'https') and v})
+        return session
+
+    def get(self, proxies=None):
+        '''
+        Session bound to `proxies` ({'https': 'socks5://ip:port'}, None = direct).
+        '''
+        key = proxy_key(proxies) if proxies else 'direct'
+        now = time.time()
+        expired = []
+        with self.lock:
+            entry = self.sessions.pop(key, None)
+            if entry is None:
+                entry = [self._new_session(proxies), now]
+            entry[1] = now
+            self.sessions[key] = entry
+            # Oldest first: stop at the first one still recent
+            for k, (session, last_used) in list(self.sessions.items()):
+                if len(self.sessions) > self.max_sessions or now - last_used > self.idle_timeout:
+                    expired.append(self.sessions.pop(k)[0])
+                else:
+                    break
+            expired += self.retired
+            self.retired = []
+        self._retire(expired)
+        return entry[0]
+
+    def _retire(self, sessions):
+        '''
+        Close evicted sessions, keeping the busy ones until their transfers end.
+        '''
+        busy = [s for s in sessions if _in_use(s)]
+        idle = [s for s in sessions if s not in busy]
+        for session in idle:
+            session.close()
+        if busy:
+            with self.lock:
+                self.retired += busy
+        if idle:
+            logging.debug(f'Closed {len(idle)} idle proxy sessions.')
+
+    def discard(self, proxies):
+        '''
+        Close the session of a proxy that turned out to be dead.
+        '''
+        key = proxy_key(proxies) if proxies else 'direct'
+        with self.lock:
+            entry = self.sessions.pop(key, None)
+        if entry:
+            self._retire([entry[0]])
+
+    def close(self):
+        with self.lock:
+            sessions = [entry[0] for entry in self.sessions.values()] + self.retired
+            self.sessions.clear()
+            self.retired = []
+        for session in sessions:
+            session.close()
+
+
+def _in_use(session):
+    '''
+    True while a response still holds one of the session's connections.
+    '''
+    for adapter in set(session.adapters.values()):
+        managers = [adapter.poolmanager, *getattr(adapter, 'proxy_manager', {}).values()]
+        for manager in managers:
+            for key in manager.pools.keys():
+                pool = manager.pools.get(key)
+                # urllib3 fills the queue with maxsize slots; a missing one is checked out
+                if pool is not None and pool.pool is not None and pool.pool.qsize() < pool.pool.maxsize:
+                    return True
+    return False
+
+
+session_pool = SessionPool()
+
+
+def get_session(proxies=None):
+    '''
+    Shared keep-alive requests.Session for `proxies`.
+    '''
+    return session_pool.get(proxies)
@@ -0,0 +1,93 @@
+import time
+from .helpers import convert_size
+
+# Samples kept per download
+RING_SIZE = 32
+# Minimum seconds between two samples, RING_SIZE * RESOLUTION is the window
+RESOLUTION = 0.25
+# Weight of the newest windowed rate in the displayed one
+ALPHA = 0.3
+
+
+class SpeedEstimator:
+    '''
+    Transfer rate over the last few seconds.
+    `sample(done)` records the byte counter in a fixed-size ring of
+    (time, bytes) pairs, the rate is the slope between the newest and the
+    oldest pair, smoothed with an EWMA. Both are O(1), and a stall shows
+    up within one window instead of being averaged over the whole download.
+    '''
+
+    def __init__(self, size=RING_SIZE, resolution=RESOLUTION, alpha=ALPHA):
+        self.size = size
+        self.resolution = resolution
+        self.alpha = alpha
+        self.reset()
+
+    def reset(self):
+        self.ring = [None] * self.size
+        self.index = 0
+        self.count = 0
+        self.smoothed = None
+        self.last = None
+
+    def sample(self, done, now=None):
+        '''
+        Record that `done` bytes have been transferred in total.
+        '''
+        now = time.monotonic() if now is None else now
+        if self.last is not None:
+            if done < self.last[1]:
+                # Restarted from a lower offset
+                self.reset()
+            elif now - self.last[0] < self.resolution:
+                return
+        self.last = (now, done)
+        oldest = self.ring[self.index] if self.count == self.size else self.ring[0]
+        self.ring[self.index] = self.last
+        self.index = (self.index + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+        if oldest is None or now <= oldest[0]:
+            return
+        rate = (done - oldest[1]) / (now - oldest[0])
+        if self.smoothed is None:
+            self.smoothed = rate
+        else:
+            self.smoothed = self.alpha * rate + (1 - self.alpha) * self.smoothed
+
+    def rate(self) -> float:
+        '''
+        Bytes per second, 0 until two samples are known.
+        '''
+        return self.smoothed or 0.0
+
+    def eta(self, remaining):
+        '''
+        Seconds left for `remaining` bytes, None while the rate is unknown.
+        '''
+        rate = self.rate()
+        if remaining <= 0:
+            return 0
+        if rate <= 0:
+            return None
+        return remaining / rate
+
+
+def format_speed(bytes_per_second) -> str:
+    if bytes_per_second < 1:
+        return '0 B/s'
+    return f'{convert_size(int(bytes_per_second))}/s'
+
+
+def format_eta(seconds) -> str:
+    '''
+    `1h 02m`, `3m 05s`, `42s` or `-` when unknown.
+    '''
+    if seconds is None:
+        return '-'
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f'{seconds // 3600}h {seconds % 3600 // 60:02d}m'
+    if seconds >= 60:
+        return f'{seconds // 60}m {seconds % 60:02d}s'
+    return f'{seconds}s'
@@ -0,0 +1,131 @@
+import os
+import json
+import time
+import logging
+import functools
+import threading
+from collections import deque
+
+# Spans kept in memory, the oldest are dropped first
+MAX_EVENTS = 200000
+
+
+class NullSpan:
+    '''
+    Span used while tracing is off, does nothing.
+    '''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+    def __init__(self, tracer, name, cat, args):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.tracer.record(self.name, self.cat, self.start, end, self.args)
+        return False
+
+    def set(self, **args):
+        '''
+        Attach values known only inside the span (proxy, outcome...).
+        '''
+        self.args.update(args)
+
+
+class Tracer:
+    '''
+    Timed spans of the download phases, exported as Chrome trace events
+    (chrome://tracing, Perfetto). Off by default: `span()` then returns
+    a shared no-op object, so instrumented code pays one attribute check.
+    '''
+
+    def __init__(self, max_events=MAX_EVENTS):
+        self.enabled = False
+        self.events = deque(maxlen=max_events)
+        self.threads = {}
+        self.origin = time.perf_counter()
+        self.pid = os.getpid()
+
+    def enable(self):
+        self.events.clear()
+        self.origin = time.perf_counter()
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def record(self, name, cat, start, end, args):
+        thread = threading.current_thread()
+        self.threads[thread.ident] = thread.name
+        # deque.append is atomic, no lock on the recording path
+        self.events.append({
+            'name': name, 'cat': cat, 'ph': 'X', 'pid': self.pid, 'tid': thread.ident,
+            'ts': round((start - self.origin) * 1e6, 1),
+            'dur': round((end - start) * 1e6, 1),
+            'args': {k: str(v) for k, v in args.items()},
+        })
+
+    def export(self, path):
+        '''
+        Write the recorded spans as Chrome trace-event JSON.
+        '''
+        events = [{'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid,
+                   'args': {'name': name}} for tid, name in list(self.threads.items())]
+        events.extend(list(self.events))
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with open(path, 'w') as f:
+                json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+            logging.info(f'Wrote {len(events)} trace events to {path}')
+        except OSError as e:
+            logging.warning(f'Failed to write trace: {e}')
+
+
+tracer = Tracer()
+
+
+def span(name, cat='download', **args):
+    '''
+    `with span('post', proxy=p):` times the block when tracing is on.
+    '''
+    if not tracer.enabled:
+        return NULL_SPAN
+    return Span(tracer, name, cat, args)
+
+
+def traced(name=None, cat='download'):
+    '''
+    Decorator putting every call of a function in a span.
+    '''
+    def decorate(function):
+        span_name = name or function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return function(*args, **kwargs)
+            with Span(tracer, span_name, cat, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
@@ -1,25 +1,35 @@
 import sys
-import queue
 import logging
 import pickle
 import os
 import time
-import qdarktheme
-import webbrowser
 import PyQt5.sip
-from ..download.workers import FilterWorker, DownloadWorker
-from PyQt5.QtCore import Qt, QThreadPool
+from ..download.workers import FilterWorker, DownloadWorker, build_row
+from ..download.bandwidth import PRIORITIES, apply_settings
+from ..download.concurrency import AdaptiveConcurrency
+from ..download.engine import DownloadEngine, NO_PASSWORD
+from ..download.job_store import get_job_store
+from ..download.metadata_cache import get_metadata_cache
+from ..download import metrics, retry
+from ..download.profiling import PROFILERS, start_profiler, stop_profiler
+from ..download.tracing import tracer
+from ..download.speed import format_eta, format_speed
+from PyQt5.QtCore import Qt, QEvent, QObject, QThreadPool, QTimer, QUrl
 from PyQt5.QtSvg import QSvgWidget
-from PyQt5.QtGui import QIcon, QStandardItemModel, QPixmap, QFontDatabase, QFont
+from PyQt5.QtGui import (QIcon, QStandardItemModel, QPixmap, QFontDatabase, QFont,
+                         QGuiApplication, QDesktopServices)
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QGridLayout,
                              QPushButton, QSpinBox, QWidget, QMessageBox,
                              QTableView, QHBoxLayout,
                              QPlainTextEdit, QVBoxLayout, QAbstractItemView,
                              QAbstractScrollArea, QLabel, QLineEdit,
                              QFileDialog, QProgressBar, QStackedWidget,
-                             QFormLayout, QListWidget, QComboBox, QSizePolicy)
-import tkinter as tk
-proxy_queue = queue.Queue()
+                             QFormLayout, QListWidget, QComboBox, QSizePolicy,
+                             QCheckBox)
+# Table refresh interval (ms) for download progress
+PROGRESS_INTERVAL = 125
+# Table column of each ProgressSnapshot field
+SNAPSHOT_COLUMNS = (0, 1, 2, 3, 4, 5, 7)
 
 
 def absp(path):
@@ -78,7 +88,7 @@ def check_selection(table):
 def create_file(f):
     '''
     Create empty file.
-    [note] Used to create app/settings and app/cache.
+    [note] Used to create app/settings.
     '''
     f = abs_config(f)
     logging.debug(f'Attempting to create file: {f}...')
@@ -88,40 +98,81 @@ def create_file(f):
 
 
 def getClipboardText():
-    root = tk.Tk()
-    # keep the window from showing
-    root.withdraw()
-    return root.clipboard_get()
+    return QApplication.clipboard().text()
+
+
+def enable_hi_dpi():
+    '''
+    Same as qdarktheme.enable_hi_dpi(), without importing qdarktheme
+    before the window is shown. Must run before QApplication is created.
+    '''
+    if hasattr(Qt, 'AA_UseHighDpiPixmaps'):
+        QGuiApplication.setAttribute(Qt.AA_UseHighDpiPixmaps)
+    if hasattr(Qt, 'AA_EnableHighDpiScaling'):
+        QGuiApplication.setAttribute(Qt.AA_EnableHighDpiScaling)
+    if hasattr(Qt, 'HighDpiScaleFactorRoundingPolicy'):
+        os.environ['QT_ENABLE_HIGHDPI_SCALING'] = '1'
+        QGuiApplication.setHighDpiScaleFactorRoundingPolicy(
+            Qt.HighDpiScaleFactorRoundingPolicy.PassThrough)
+
+
+def setup_theme(theme):
+    '''
+    Apply the 'light' or 'dark' qdarktheme stylesheet.
+    qdarktheme is imported on first use, after the first paint.
+    '''
+    import qdarktheme
+    setup = getattr(qdarktheme, 'setup_theme', None)
+    if callable(setup):
+        setup(theme)
+
+
+class FirstPaint(QObject):
+    '''
+    Startup benchmark (`--startup-time FILE`): writes the time of the
+    main window's first paint to FILE and quits.
+    '''
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.done = False
+
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Paint and not self.done:
+            self.done = True
+            with open(self.path, 'w') as f:
+                f.write(str(time.time()))
+            QTimer.singleShot(0, QApplication.instance().quit)
+        return False
 
 
 class GuiBehavior:
     def __init__(self, gui):
         self.filter_thread = QThreadPool()
-        self.download_thread = QThreadPool()
-        # Limits concurrent downloads to 1.
-        self.download_thread.setMaxThreadCount(1)
+        # Unfinished downloads, saved as they change (app/jobs.db)
+        self.job_store = get_job_store()
+        # Limits concurrent downloads to 1 until settings are loaded.
+        self.engine = DownloadEngine(max_workers=1, store=self.job_store)
+        # Adjusts parallel downloads when enabled in settings
+        self.concurrency = AdaptiveConcurrency(self.engine)
         self.download_workers = []
         self.gui = gui
+        # Progress of every download is published by one timer
+        self.progress_bus = self.engine.bus
+        self.progress_timer = QTimer()
+        self.progress_timer.timeout.connect(self.publish_progress)
+        self.progress_timer.start(PROGRESS_INTERVAL)
+        self.gui.table_model.itemChanged.connect(self.password_changed)
         self.handle_init()
 
     def handle_init(self):
         '''
-        Load cached downloads.
-        Create file in case it does not exist.
+        Load unfinished downloads, once the table exists.
         '''
-        try:
-            with open(abs_config('app/cache'), 'rb') as f:
-                self.cached_downloads = pickle.load(f)
-                for download in self.cached_downloads:
-                    self.gui.links = download[0]
-                    self.add_links(True, download)
-        except EOFError:
-            self.cached_downloads = []
-            logging.debug('No cached downloads.')
-        except FileNotFoundError:
-            logging.debug('create New cache File.')
-            self.cached_downloads = []
-            create_file('app/cache')
+        # Queue saved by older versions
+        self.job_store.import_pickle(abs_config('app/cache'))
+        QTimer.singleShot(0, self.restore_downloads)
 
         '''
         Load settings.
@@ -131,8 +182,12 @@ class GuiBehavior:
             with open(abs_config('app/settings'), 'rb') as f:
                 self.settings = pickle.load(f)
                 thread_count = self.settings[4]
-                self.download_thread.setMaxThreadCount(int(thread_count))
+                self.apply_concurrency()
                 logging.debug('Now Settings Thread Count:'+str(thread_count))
+                apply_settings(self.settings)
+                metrics.apply_settings(self.settings)
+                retry.apply_settings(self.settings)
+                self.apply_diagnostics()
         except EOFError:
             self.settings = None
             logging.debug('No settings found.')
@@ -144,7 +199,35 @@ class GuiBehavior:
             # settings Use default value of 3 when there is no fourth element in the list
             self.settings = None
             thread_count = 3
-            self.download_thread.setMaxThreadCount(int(thread_count))
+            self.engine.set_max_workers(int(thread_count))
+
+    def apply_diagnostics(self):
+        '''
+        Record spans when a trace file is set (settings[13]) and run the
+        profiler chosen in settings[14]. Both are written on exit.
+        '''
+        trace_path = self.settings[13] if self.settings and len(self.settings) > 13 else ''
+        if trace_path and not tracer.enabled:
+            tracer.enable()
+        elif not trace_path:
+            tracer.disable()
+        if self.settings and len(self.settings) > 14:
+            # Profiles cover a whole session, a change applies after a restart
+            start_profiler(self.settings[14])
+
+    def apply_concurrency(self):
+        '''
+        Fixed number of parallel downloads (settings[4]), or adjusted
+        between 1 and that number when settings[9] is set.
+        '''
+        max_workers = int(self.settings[4]) if self.settings else 1
+        if self.settings and len(self.settings) > 9 and self.settings[9]:
+            self.concurrency.set_bounds(1, max_workers)
+            self.concurrency.start()
+        else:
+            self.concurrency.stop()
+            self.concurrency.decision = ''
+            self.engine.set_max_workers(max_workers)
 
     def show_loading_overlay(self):
         '''
@@ -169,7 +252,7 @@ class GuiBehavior:
         if selected_rows:
             for i in selected_rows:
                 if i < len(self.download_workers):
-                    self.download_workers[i].resume()
+                    self.engine.resume(self.download_workers[i])
 
     def stop_download(self):
         '''
@@ -180,7 +263,8 @@ class GuiBehavior:
         if selected_rows:
             for i in reversed(selected_rows):
                 if i < len(self.download_workers):
-                    self.download_workers[i].stop(i)
+                    self.gui.table_model.removeRow(i)
+                    self.engine.stop(self.download_workers[i])
                     # Remove the download worker from the list
                     del self.download_workers[i]
 
@@ -192,33 +276,79 @@ class GuiBehavior:
         if selected_rows:
             for i in selected_rows:
                 if i < len(self.download_workers):
-                    update_data = [None, None, 'Pause', None, '0 B/s']
-                    # update_signal only if it is a list type
-                    if isinstance(self.download_workers[i].data, list):
-                        self.download_workers[i].signals.update_signal.emit(
-                            self.download_workers[i].data, update_data)
-                        self.download_workers[i].pause()
+                    self.download_workers[i].progress.stop_transfer('Pause')
+                    self.engine.pause(self.download_workers[i])
 
-    def add_links(self, state, cached_download=''):
+    def set_priority(self, index):
+        '''
+        Apply the chosen priority to the selected downloads.
+        '''
+        selected_rows = check_selection(self.gui.table)
+        if selected_rows:
+            weight = PRIORITIES[self.gui.main.priority_select.itemText(index)]
+            for i in selected_rows:
+                if i < len(self.download_workers):
+                    self.engine.set_priority(self.download_workers[i], weight)
+
+    def restore_downloads(self):
+        '''
+        Queue the downloads saved in the job store again,
+        from the saved name and size without fetching anything.
+        '''
+        jobs = self.job_store.load()
+        logging.debug(f'Restoring {len(jobs)} downloads.')
+        batch = []
+        for job in jobs:
+            row = build_row(job['name'] or job['dl_name'] or job['link'],
+                            job['size'] or '- MB', job['password'])
+            progress = 10000 * job['done'] / job['total'] if job['total'] else 0
+            batch.append([row, job['link'], job['dl_name'], progress, job['id']])
+        if batch:
+            self.download_receive_batch(batch)
+
+    def add_links(self, state):
         '''
         Calls FilterWorker()
         '''
         logging.debug('Call add_links')
         # Show loading overlay
         self.show_loading_overlay()
-        worker = FilterWorker(
-            self, cached_download, (self.gui.password.text() if not cached_download else ''))
+        worker = FilterWorker(self, self.gui.password.text())
 
-        worker.signals.download_signal.connect(self.download_receive_signal)
+        worker.signals.download_signal.connect(self.download_receive_batch)
         worker.signals.alert_signal.connect(alert)
 
         self.filter_thread.start(worker)
 
-    def download_receive_signal(self, row, link, append_row=True, dl_name='', progress=0):
+    def download_receive_batch(self, batch):
+        '''
+        Append a batch of [row, link, dl_name, progress, job_id].
+        New downloads (job_id None) are saved in one transaction.
+        '''
+        new = [entry for entry in batch if entry[4] is None]
+        job_ids = self.job_store.add_many([
+            (link, row[0].text(), row[1].text(), dl_name,
+             None if row[6].text() == NO_PASSWORD else row[6].text())
+            for row, link, dl_name, progress, job_id in new])
+        for entry, job_id in zip(new, job_ids):
+            entry[4] = job_id
+
+        self.gui.table.setUpdatesEnabled(False)
+        try:
+            for row, link, dl_name, progress, job_id in batch:
+                self.download_receive_signal(
+                    row, link, True, dl_name, progress or 0, job_id)
+        finally:
+            self.gui.table.setUpdatesEnabled(True)
+
+    def download_receive_signal(self, row, link, append_row=True, dl_name='', progress=0,
+                                job_id=None):
         '''
         Append download to row and start download.
         '''
         if append_row:
+            # Rows move when the table is sorted, the job is found by its id
+            row[6].setData(job_id, Qt.UserRole)
             self.gui.table_model.appendRow(row)
             index = self.gui.table_model.index(
                 self.gui.table_model.rowCount()-1, 5)
@@ -233,33 +363,58 @@ class GuiBehavior:
             row[5] = progress_bar
 
         worker = DownloadWorker(
-            link, self.gui.table_model, row, self.settings, dl_name)
+            link, row, self.settings, dl_name, self.progress_bus.track(row), job_id)
 
-        worker.signals.update_signal.connect(self.update_receive_signal)
-        worker.signals.unpause_signal.connect(self.download_receive_signal)
-
-        self.download_thread.start(worker)
+        self.engine.submit(worker)
         self.download_workers.append(worker)
         self.hide_loading_overlay()
         # Re-enable button after adding link
         self.gui.add_links_complete()
 
-    def update_receive_signal(self, data, items):
+    def password_changed(self, item):
+        '''
+        Save a password typed in the table.
+        '''
+        if item.column() != 6:
+            return
+        job_id = item.data(Qt.UserRole)
+        for worker in self.download_workers:
+            if worker.job_id is not None and worker.job_id == job_id:
+                self.engine.set_password(worker, item.text())
+                break
+
+    def publish_progress(self):
+        '''
+        Redraw the rows of downloads that changed since the last tick.
+        '''
+        for data, snapshot in self.progress_bus.collect():
+            self.update_row(data, snapshot)
+        rate, eta = self.progress_bus.totals()
+        total = f'{format_speed(rate)}, {format_eta(eta)} left' if rate else ''
+        if total != self.gui.main.total_label.text():
+            self.gui.main.total_label.setText(total)
+        decision = self.concurrency.decision
+        if decision != self.gui.main.concurrency_label.text():
+            self.gui.main.concurrency_label.setText(decision)
+
+    def update_row(self, data, snapshot):
         '''
         Update download data.
-        items = [File Name, Size, Down Speed, Progress, Pass]
+        snapshot = ProgressSnapshot(Name, Size, Status, Proxy, Down Speed, Progress, ETA)
         '''
-        if data and isinstance(data, list) and isinstance(items, list):
+        if data and isinstance(data, list):
             if not PyQt5.sip.isdeleted(data[2]):
-                for i in range(len(items)):
-                    if items[i] and isinstance(items[i], str):
-                        data[i].setText(str(items[i]))
-                    if items[i] and not isinstance(items[i], str):
+                for i, value in zip(SNAPSHOT_COLUMNS, snapshot):
+                    if value is None:
+                        continue
+                    if isinstance(value, str):
+                        data[i].setText(value)
+                    elif not PyQt5.sip.isdeleted(data[i]):
                         # setting the value by multiplying it to 100
                         n = 100
                         # progress_bar float issue casting fix
-                        data[i].setValue(int(items[i]) * n)
-                        data[i].setFormat("%.02f %%" % items[i])
+                        data[i].setValue(int(value * n))
+                        data[i].setFormat("%.02f %%" % value)
 
     def set_dl_directory(self):
         file_dialog = QFileDialog(self.gui.settings)
@@ -277,14 +432,10 @@ class GuiBehavior:
             self.gui.theme_select.setCurrentIndex(theme)
 
         if self.gui.theme_select.currentIndex() == 0:
-            setup_theme = getattr(qdarktheme, "setup_theme", None)
-            if callable(setup_theme):
-                qdarktheme.setup_theme("light")
+            setup_theme("light")
             # self.gui.app.setPalette(self.gui.main.style().standardPalette())
         elif self.gui.theme_select.currentIndex() == 1:
-            setup_theme = getattr(qdarktheme, "setup_theme", None)
-            if callable(setup_theme):
-                qdarktheme.setup_theme("dark")
+            setup_theme("dark")
             # self.gui.app.setPalette(dark_theme)
 
     def get_language(self):
@@ -324,13 +475,44 @@ class GuiBehavior:
             settings.append(self.gui.proxy_settings_input.text())
 			# Number of multi-downloads
             # Thread Settings     - 4
-            settings.append(1)
-            # settings.append(self.gui.thread_input.value())
+            settings.append(self.gui.thread_input.value())
+            # Proxy Race Count   - 5
+            settings.append(self.gui.race_input.value())
+            # Segments per File  - 6
+            settings.append(self.gui.segment_input.value())
+            # Bandwidth Limit    - 7
+            settings.append(self.gui.limit_input.text())
+            # Limit Schedule     - 8
+            settings.append(self.gui.schedule_input.text())
+            # Adaptive Threads   - 9
+            settings.append(self.gui.adaptive_input.isChecked())
             # Select language
-            # Lang Settings     - 5
+            # Lang Settings     - 10
             # settings.append(self.gui.lang_select.currentIndex())
+            settings.append(None)
+            # Metrics Port       - 11
+            settings.append(self.gui.metrics_port_input.value())
+            # Metrics JSON File  - 12
+            settings.append(self.gui.metrics_json_input.text())
+            # Trace File         - 13
+            settings.append(self.gui.trace_input.text())
+            # Profiler           - 14
+            settings.append(self.gui.profiler_select.currentData())
+            # Resolution Attempts - 15
+            settings.append(self.gui.resolve_attempts_input.value())
+            # Transfer Attempts  - 16
+            settings.append(self.gui.transfer_attempts_input.value())
+            # Max Backoff        - 17
+            settings.append(self.gui.max_backoff_input.value())
+            # Breaker Threshold  - 18
+            settings.append(self.gui.breaker_input.value())
             pickle.dump(settings, f)
             self.settings = settings
+        apply_settings(self.settings)
+        metrics.apply_settings(self.settings)
+        retry.apply_settings(self.settings)
+        self.apply_diagnostics()
+        self.apply_concurrency()
         self.gui.settings.hide()
 
     def select_settings(self):
@@ -342,18 +524,16 @@ class GuiBehavior:
 
     def handle_exit(self):
         '''
-        Save cached downloads data.
+        Save the progress of unfinished downloads.
         '''
-        active_downloads = []
-        for w in self.download_workers:
-            download = w.return_data()
-            if download:
-                active_downloads.append(download)
-        active_downloads.extend(self.cached_downloads)
-
-        with open(abs_config('app/cache'), 'wb') as f:
-            if active_downloads:
-                pickle.dump(active_downloads, f)
+        self.engine.close()
+        self.job_store.close()
+        # os._exit() skips the atexit save
+        get_metadata_cache().save()
+        metrics.close()
+        if tracer.enabled:
+            tracer.export(self.settings[13])
+        stop_profiler()
 
         os._exit(1)
 
@@ -365,13 +545,8 @@ class Gui:
         self.font = None
 
         # Create App
-        enable_hi_dpi = getattr(qdarktheme, "enable_hi_dpi", None)
-        if callable(enable_hi_dpi):
-            qdarktheme.enable_hi_dpi()
+        enable_hi_dpi()
         app = QApplication(sys.argv)
-        setup_theme = getattr(qdarktheme, "setup_theme", None)
-        if callable(setup_theme):
-            qdarktheme.setup_theme("light")
 
         font_database = QFontDatabase()
         font_id = font_database.addApplicationFont(
@@ -388,6 +563,10 @@ class Gui:
 
         # Initialize self.main
         self.main_init()
+        if '--startup-time' in sys.argv[:-1]:
+            self.first_paint = FirstPaint(
+                sys.argv[sys.argv.index('--startup-time') + 1])
+            self.main.installEventFilter(self.first_paint)
         self.actions = GuiBehavior(self)
         app.aboutToQuit.connect(self.actions.handle_exit)
 
@@ -397,9 +576,9 @@ class Gui:
         # self.add_links_clipboard()
         self.settings_win()
 
-        # Change App Theme to saved one (Palette)
-        if self.actions.settings:
-            self.actions.change_theme(self.actions.settings[1])
+        # Change App Theme to saved one (Palette), once the window is painted
+        QTimer.singleShot(0, lambda: self.actions.change_theme(
+            self.actions.settings[1] if self.actions.settings else None))
 
         sys.exit(app.exec_())
 
@@ -417,25 +596,28 @@ class Gui:
         download_clipboard_btn = QPushButton(
             QIcon(absp('res/clipboard.svg')), ' Add from clipboard')
         download_clipboard_btn.clicked.connect(self.add_links_clipboard)
-        download_clipboard_btn.setFont(self.font)
+        if self.font:
+            download_clipboard_btn.setFont(self.font)
 
         # Top Buttons
         download_btn = QPushButton(
             QIcon(absp('res/download.svg')), ' Add Link(s)')
         download_btn.clicked.connect(lambda: self.add_links.show(
         ) if not self.add_links.isVisible() else self.add_links.raise_())
-        download_btn.setFont(self.font)
+        if self.font:
+            download_btn.setFont(self.font)
 
         settings_btn = QPushButton(
             QIcon(absp('res/settings.svg')), ' Settings')
         settings_btn.clicked.connect(lambda: self.settings.show(
         ) if not self.settings.isVisible() else self.settings.raise_())
-        settings_btn.setFont(self.font)
+        if self.font:
+            settings_btn.setFont(self.font)
 
         # Table
         self.table = QTableView()
         headers = ['Name', 'Size', 'Status', 'Proxy server',
-                    'Down Speed', 'Progress', 'Password']
+                    'Down Speed', 'Progress', 'Password', 'ETA']
         self.table.setSizeAdjustPolicy(
             QAbstractScrollArea.AdjustToContentsOnFirstShow)
         self.table.horizontalHeader().setStretchLastSection(True)
@@ -448,6 +630,8 @@ class Gui:
         self.table_model = QStandardItemModel()
         self.table_model.setHorizontalHeaderLabels(headers)
         self.table.setModel(self.table_model)
+        # Show ETA next to the speed, Password stays last
+        self.table.horizontalHeader().moveSection(7, 5)
 
         # Append widgets to grid
         grid.addWidget(download_clipboard_btn, 0, 0)
@@ -461,17 +645,34 @@ class Gui:
         # Bottom Buttons
         self.main.resume_btn = QPushButton(
             QIcon(absp('res/resume.svg')), ' Resume')
-        self.main.resume_btn.setFont(self.font)
+        if self.font:
+            self.main.resume_btn.setFont(self.font)
         self.main.pause_btn = QPushButton(
             QIcon(absp('res/pause.svg')), ' Pause')
-        self.main.pause_btn.setFont(self.font)
+        if self.font:
+            self.main.pause_btn.setFont(self.font)
         self.main.stop_btn = QPushButton(
             QIcon(absp('res/stop.svg')), ' Remove')
-        self.main.stop_btn.setFont(self.font)
+        if self.font:
+            self.main.stop_btn.setFont(self.font)
+
+        self.main.priority_select = QComboBox()
+        self.main.priority_select.addItems(list(PRIORITIES))
+        self.main.priority_select.setCurrentText('Normal')
+        self.main.priority_select.setToolTip('Bandwidth priority of the selected downloads')
 
         hbox.addWidget(self.main.resume_btn)
         hbox.addWidget(self.main.pause_btn)
         hbox.addWidget(self.main.stop_btn)
+        hbox.addWidget(self.main.priority_select)
+
+        # Decisions of the concurrency controller
+        self.main.concurrency_label = QLabel()
+        hbox.addWidget(self.main.concurrency_label)
+
+        # Speed and time left of all downloads
+        self.main.total_label = QLabel()
+        hbox.addWidget(self.main.total_label)
 
         self.main.setWindowFlags(self.main.windowFlags()
                                  & Qt.CustomizeWindowHint)
@@ -503,6 +704,7 @@ class Gui:
         self.main.resume_btn.clicked.connect(self.actions.resume_download)
         self.main.pause_btn.clicked.connect(self.actions.pause_download)
         self.main.stop_btn.clicked.connect(self.actions.stop_download)
+        self.main.priority_select.activated.connect(self.actions.set_priority)
 
     # Method to get the address of the clipboard and pass it to add_links
     def add_links_clipboard(self):
@@ -657,14 +859,135 @@ class Gui:
 
         form_layout_c.addRow(self.proxy_settings_input)
 
-        # form_layout_c.addRow(QLabel('Number of simultaneous proxy downloads (requires restart):'))
-        # self.thread_input = QSpinBox()
-        # if self.actions.settings is not None:
-        #     self.thread_input.setValue(self.actions.settings[4])
-        # else:
-        #     self.thread_input.setValue(3)
+        # Proxy racing
+        form_layout_c.addRow(QLabel('Proxies tried at once to find the link (1 = one by one):'))
+        self.race_input = QSpinBox()
+        self.race_input.setRange(1, 32)
+        if self.actions.settings is not None and len(self.actions.settings) > 5:
+            self.race_input.setValue(self.actions.settings[5])
+        else:
+            self.race_input.setValue(4)
+
+        form_layout_c.addRow(self.race_input)
+
+        # Segmented download
+        form_layout_c.addRow(QLabel('Connections per file (1 = single connection):'))
+        self.segment_input = QSpinBox()
+        self.segment_input.setRange(1, 16)
+        if self.actions.settings is not None and len(self.actions.settings) > 6:
+            self.segment_input.setValue(self.actions.settings[6])
+        else:
+            self.segment_input.setValue(1)
+
+        form_layout_c.addRow(self.segment_input)
+
+        # Bandwidth limit
+        form_layout_c.addRow(QLabel('Bandwidth limit, e.g. 2M (empty = unlimited):'))
+        self.limit_input = QLineEdit()
+        if self.actions.settings is not None and len(self.actions.settings) > 7:
+            self.limit_input.setText(self.actions.settings[7])
+
+        form_layout_c.addRow(self.limit_input)
+
+        form_layout_c.addRow(QLabel('Limit by time of day, e.g. 08:00-23:00=512K; 23:00-08:00=0:'))
+        self.schedule_input = QLineEdit()
+        if self.actions.settings is not None and len(self.actions.settings) > 8:
+            self.schedule_input.setText(self.actions.settings[8])
+
+        form_layout_c.addRow(self.schedule_input)
+
+        form_layout_c.addRow(QLabel('Number of simultaneous downloads (maximum when adjusted):'))
+        self.thread_input = QSpinBox()
+        self.thread_input.setRange(1, 32)
+        if self.actions.settings is not None:
+            self.thread_input.setValue(self.actions.settings[4])
+        else:
+            self.thread_input.setValue(1)
+
+        form_layout_c.addRow(self.thread_input)
+
+        self.adaptive_input = QCheckBox(
+            'Adjust simultaneous downloads to throughput and failures')
+        if self.actions.settings is not None and len(self.actions.settings) > 9:
+            self.adaptive_input.setChecked(bool(self.actions.settings[9]))
+
+        form_layout_c.addRow(self.adaptive_input)
+
+        # Retries
+        form_layout_c.addRow(QLabel('Attempts to get the download link per file (0 = no limit):'))
+        self.resolve_attempts_input = QSpinBox()
+        self.resolve_attempts_input.setRange(0, 100000)
+        if self.actions.settings is not None and len(self.actions.settings) > 15:
+            self.resolve_attempts_input.setValue(self.actions.settings[15])
+        else:
+            self.resolve_attempts_input.setValue(300)
+
+        form_layout_c.addRow(self.resolve_attempts_input)
+
+        form_layout_c.addRow(QLabel('Broken transfers per file before giving up (0 = no limit):'))
+        self.transfer_attempts_input = QSpinBox()
+        self.transfer_attempts_input.setRange(0, 1000)
+        if self.actions.settings is not None and len(self.actions.settings) > 16:
+            self.transfer_attempts_input.setValue(self.actions.settings[16])
+        else:
+            self.transfer_attempts_input.setValue(10)
+
+        form_layout_c.addRow(self.transfer_attempts_input)
+
+        form_layout_c.addRow(QLabel('Longest wait between two attempts (seconds):'))
+        self.max_backoff_input = QSpinBox()
+        self.max_backoff_input.setRange(1, 3600)
+        if self.actions.settings is not None and len(self.actions.settings) > 17:
+            self.max_backoff_input.setValue(self.actions.settings[17])
+        else:
+            self.max_backoff_input.setValue(30)
+
+        form_layout_c.addRow(self.max_backoff_input)
+
+        form_layout_c.addRow(QLabel('Pause all downloads after this many 1fichier errors in a row (0 = off):'))
+        self.breaker_input = QSpinBox()
+        self.breaker_input.setRange(0, 1000)
+        if self.actions.settings is not None and len(self.actions.settings) > 18:
+            self.breaker_input.setValue(self.actions.settings[18])
+        else:
+            self.breaker_input.setValue(5)
+
+        form_layout_c.addRow(self.breaker_input)
+
+        # Metrics export
+        form_layout_c.addRow(QLabel('Metrics port on localhost (0 = off):'))
+        self.metrics_port_input = QSpinBox()
+        self.metrics_port_input.setRange(0, 65535)
+        if self.actions.settings is not None and len(self.actions.settings) > 11:
+            self.metrics_port_input.setValue(self.actions.settings[11])
+
+        form_layout_c.addRow(self.metrics_port_input)
+
+        form_layout_c.addRow(QLabel('Write metrics as JSON to (empty = off):'))
+        self.metrics_json_input = QLineEdit()
+        if self.actions.settings is not None and len(self.actions.settings) > 12:
+            self.metrics_json_input.setText(self.actions.settings[12])
+
+        form_layout_c.addRow(self.metrics_json_input)
+
+        # Tracing and profiling
+        form_layout_c.addRow(QLabel('Write a trace of the download phases on exit to (empty = off):'))
+        self.trace_input = QLineEdit()
+        if self.actions.settings is not None and len(self.actions.settings) > 13:
+            self.trace_input.setText(self.actions.settings[13])
+
+        form_layout_c.addRow(self.trace_input)
+
+        form_layout_c.addRow(QLabel('Profiler (from the next start, written to app/):'))
+        self.profiler_select = QComboBox()
+        self.profiler_select.addItem('Off', '')
+        for kind in PROFILERS:
+            self.profiler_select.addItem(kind, kind)
+        if self.actions.settings is not None and len(self.actions.settings) > 14:
+            self.profiler_select.setCurrentIndex(
+                max(self.profiler_select.findData(self.actions.settings[14]), 0))
 
-        # form_layout_c.addRow(self.thread_input)
+        form_layout_c.addRow(self.profiler_select)
 
         # Bottom buttons
         save_settings_c = QPushButton('Save')
@@ -695,8 +1018,8 @@ class Gui:
 
         github_btn = QPushButton(QIcon(absp('res/github.svg')), '')
         github_btn.setFixedWidth(32)
-        github_btn.clicked.connect(lambda: webbrowser.open(
-            'https://github.com/leinad4mind/1fichier-dl'))
+        github_btn.clicked.connect(lambda: QDesktopServices.openUrl(
+            QUrl('https://github.com/leinad4mind/1fichier-dl')))
 
         about_layout.addWidget(logo, 0, 0, 1, 0)
         about_layout.addWidget(github_btn, 1, 0)